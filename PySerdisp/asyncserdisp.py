@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from pyserdisp import Serdisp
+
+class Batch:
+	"""
+	Collects Serdisp calls and runs them all in one go on the display
+	worker when awaited:
+
+		batch = display.batch()
+		batch.setColour((0, 0), Serdisp.BLACK)
+		batch.flush()
+		sent = await batch # result of the last call
+	"""
+	def __init__(self, display):
+		self.__display = display
+		self.__calls = []
+
+	def __getattr__(self, name):
+		# Validate right away rather than failing on the worker thread later
+		getattr(self.__display.serdisp, name)
+
+		def record(*args, **kwargs):
+			self.__calls.append((name, args, kwargs))
+			return self
+		return record
+
+	def __runCalls(self, serdisp, calls):
+		result = None
+		for name, args, kwargs in calls:
+			result = getattr(serdisp, name)(*args, **kwargs)
+		return result
+
+	def __await__(self):
+		calls = self.__calls
+		self.__calls = []
+		return self.__display.run(self.__runCalls, self.__display.serdisp, calls).__await__()
+
+class AsyncSerdisp:
+	"""
+	asyncio facade for Serdisp. All calls into serdisplib happen on a single
+	worker thread in the order they were made, so the event loop keeps running
+	while the display does its (potentially slow) I/O.
+
+		display = await AsyncSerdisp.open("USB:7c0/1501", "CTINCLUD")
+		await display.frame(lambda: clock.draw())
+		await display.close()
+
+	Widgets draw into the framebuffer and are not thread-safe, so draw them
+	through frame() or run() rather than from the event loop.
+	"""
+	def __init__(self, serdisp, executor=None):
+		self.serdisp = serdisp
+		self.__executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="serdisp")
+
+	@classmethod
+	async def open(cls, device, model, options = "", backend = None):
+		"""
+		Opens the display on the worker thread, initializing it blocks as well.
+		"""
+		executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serdisp")
+		loop = asyncio.get_running_loop()
+		try:
+			serdisp = await loop.run_in_executor(executor, partial(Serdisp, device, model, options, backend))
+		except:
+			executor.shutdown(wait=False)
+			raise
+		return cls(serdisp, executor)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, type, value, traceback):
+		if self.serdisp.turnOffOnQuit:
+			await self.quit()
+		else:
+			await self.close()
+
+	def run(self, func, *args, **kwargs):
+		"""
+		Runs `func` on the worker thread and returns an awaitable for its result.
+		"""
+		loop = asyncio.get_running_loop()
+		return loop.run_in_executor(self.__executor, partial(func, *args, **kwargs))
+
+	def batch(self):
+		return Batch(self)
+
+	async def frame(self, draw):
+		"""
+		Runs `draw()` and flushes the result on the worker thread, one await
+		for a whole frame. Returns the number of pixels sent.
+		"""
+		def drawAndFlush():
+			draw()
+			return self.serdisp.flush()
+		return await self.run(drawAndFlush)
+
+	async def flush(self, full=False):
+		return await self.run(self.serdisp.flush, full)
+
+	async def update(self):
+		await self.run(self.serdisp.update)
+
+	async def rewrite(self):
+		await self.run(self.serdisp.rewrite)
+
+	async def clear(self):
+		await self.run(self.serdisp.clear)
+
+	async def setColour(self, pos, colour):
+		await self.run(self.serdisp.setColour, pos, colour)
+
+	async def setGrey(self, pos, grey):
+		await self.run(self.serdisp.setGrey, pos, grey)
+
+	async def close(self):
+		await self.run(self.serdisp.close)
+		self.__executor.shutdown(wait=False)
+
+	async def quit(self):
+		await self.run(self.serdisp.quit)
+		self.__executor.shutdown(wait=False)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Widget and flush benchmarks against a VirtualDisplay.
+
+	python benchmark.py --font /usr/share/fonts/TTF/DejaVuSans.ttf
+	python benchmark.py --font ... --save		# store the results as baseline
+	python benchmark.py --font ... --compare	# flag regressions against the baseline
+	python benchmark.py --replay dashboard.sdr	# replay a recording (see recorder.py)
+
+For every scenario it reports frames per second, serdisplib calls per frame,
+the memory blocks allocated per frame that are still alive when it ends and
+the peak memory allocated while drawing a frame, both as seen by tracemalloc.
+Scenarios that need a font are skipped if none is given.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pyserdisp import Serdisp
+from recorder import Replayer
+from virtualdisplay import VirtualDisplay
+
+WIDTH = 240
+HEIGHT = 128
+DEPTH = 1
+
+LONG_TEXT = "The quick brown fox jumps over the lazy dog while the display keeps scrolling along"
+
+# Allocations of tracemalloc itself don't count
+_ALLOCATION_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),)
+
+# Result key, True if higher is better, format for regressions
+_METRICS = (
+	("fps", True, "%.1f fps"),
+	("callsPerFrame", False, "%.1f calls/frame"),
+	("allocsPerFrame", False, "%.1f allocs/frame"),
+	("peakKibPerFrame", False, "%.1f peak KiB/frame"),
+)
+
+class Scenario:
+	"""
+	A named set of widgets. `setup(serdisp)` returns a callable that draws
+	one frame, the frame is flushed afterwards unless `flush` is False.
+	"""
+	def __init__(self, name, setup, needsFont=False, flush=True):
+		self.name = name
+		self.setup = setup
+		self.needsFont = needsFont
+		self.flush = flush
+
+def _makeImage(directory):
+	from PIL import Image
+
+	path = os.path.join(directory, "benchmark.png")
+	img = Image.new("L", (WIDTH, HEIGHT))
+	img.putdata([(x * 255 // WIDTH) ^ (y * 2 & 0xFF) for y in range(HEIGHT) for x in range(WIDTH)])
+	img.convert("RGB").save(path)
+	return path
+
+def _pixmap(serdisp, options):
+	from widget import Pixmap
+
+	pixmap = Pixmap(serdisp, options.image, (0, 0))
+	return pixmap.draw
+
+def _scrollingText(serdisp, options):
+	from widget import Text
+
+	text = Text(serdisp, (2, 2), options.font, 32, LONG_TEXT, sliceDuration=0)
+	return text.draw
+
+def _progressbars(serdisp, options):
+	from widget import Progressbar
+
+	bars = [Progressbar(serdisp, (10, 10 + i * 20), (220, 12)) for i in range(5)]
+	frame = [0]
+
+	def draw():
+		frame[0] += 1
+		for i, bar in enumerate(bars):
+			bar.setState(((frame[0] * (i + 1)) % 100) / 100.0)
+			bar.draw()
+	return draw
+
+def _dashboard(serdisp, options):
+	from widget import Pixmap, Progressbar, Text
+
+	logo = Pixmap(serdisp, options.image, (0, 0))
+	clock = Text(serdisp, (2, 2), options.font, 24, "00:00:00", halign="right")
+	ticker = Text(serdisp, (2, 2), options.font, 16, LONG_TEXT, valign="bottom", sliceDuration=0)
+	bar = Progressbar(serdisp, (10, 60), (220, 10))
+	frame = [0]
+
+	def draw():
+		frame[0] += 1
+		clock.setText("00:00:%02i" % (frame[0] % 60))
+		bar.setState((frame[0] % 100) / 100.0)
+		logo.draw()
+		clock.draw()
+		ticker.draw()
+		bar.draw()
+	return draw
+
+def _sceneDashboard(serdisp, options):
+	from scene import Scene
+	from widget import Pixmap, Progressbar, Text
+
+	scene = Scene(serdisp)
+	scene.add(Pixmap(serdisp, options.image, (0, 0)))
+	clock = scene.add(Text(serdisp, (2, 2), options.font, 24, "00:00:00", halign="right"), z=1)
+	scene.add(Text(serdisp, (2, 2), options.font, 16, LONG_TEXT, valign="bottom", sliceDuration=0), z=1)
+	bar = scene.add(Progressbar(serdisp, (10, 60), (220, 10)), z=1)
+	frame = [0]
+
+	def draw():
+		frame[0] += 1
+		clock.setText("00:00:%02i" % (frame[0] % 60))
+		bar.setState((frame[0] % 100) / 100.0)
+		scene.render()
+	return draw
+
+def _renderText(serdisp, options):
+	from textrenderer import Font
+
+	font = Font(options.font, 32)
+	return lambda: font.render_text(LONG_TEXT)
+
+SCENARIOS = (
+	Scenario("pixmap", _pixmap),
+	Scenario("scrolling-text", _scrollingText, needsFont=True),
+	Scenario("progressbars", _progressbars),
+	Scenario("dashboard", _dashboard, needsFont=True),
+	Scenario("scene-dashboard", _sceneDashboard, needsFont=True, flush=False),
+	Scenario("render-text", _renderText, needsFont=True),
+)
+
+def _allocations(before, after):
+	"""
+	Returns the number of memory blocks allocated between two tracemalloc
+	snapshots and still alive in the second one.
+	"""
+	after = after.filter_traces(_ALLOCATION_FILTERS)
+	before = before.filter_traces(_ALLOCATION_FILTERS)
+	return sum(max(0, stat.count_diff) for stat in after.compare_to(before, "lineno"))
+
+def run(scenario, options):
+	"""
+	Runs a scenario for `options.frames` frames and returns its results.
+	"""
+	virtual = VirtualDisplay(WIDTH, HEIGHT, DEPTH)
+	serdisp = Serdisp("VIRTUAL", "VIRTUAL", backend=virtual, packed=options.packed)
+	try:
+		drawFrame = scenario.setup(serdisp, options)
+
+		def frame():
+			drawFrame()
+			if scenario.flush:
+				serdisp.flush()
+
+		# Warm up caches before measuring anything
+		frame()
+		virtual.resetCounters()
+
+		start = time.perf_counter()
+		for i in range(options.frames):
+			frame()
+		elapsed = time.perf_counter() - start
+		calls = sum(virtual.calls.values())
+
+		# Allocations are measured separately since tracing slows everything down
+		tracemalloc.start()
+		peak = 0
+		allocations = 0
+		measured = min(options.frames, 10)
+		for i in range(measured):
+			before = tracemalloc.take_snapshot()
+			tracemalloc.reset_peak()
+			base = tracemalloc.get_traced_memory()[0]
+			frame()
+			peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+			allocations += _allocations(before, tracemalloc.take_snapshot())
+		tracemalloc.stop()
+	finally:
+		serdisp.close()
+
+	return {
+		"fps": options.frames / elapsed if elapsed > 0 else float("inf"),
+		"callsPerFrame": calls / float(options.frames),
+		"allocsPerFrame": allocations / float(max(1, measured)),
+		"peakKibPerFrame": peak / 1024.0,
+	}
+
+def runReplay(replayer, viaFramebuffer):
+	"""
+	Replays a recording as fast as possible, each update or rewrite counting
+	as a frame. Allocations are averaged and the peak memory is taken over
+	the whole replay.
+	"""
+	virtual = VirtualDisplay(*replayer.geometry)
+	serdisp = Serdisp("VIRTUAL", "VIRTUAL", backend=virtual)
+	try:
+		virtual.resetCounters()
+		elapsed = replayer.replay(serdisp, viaFramebuffer=viaFramebuffer)
+		calls = sum(virtual.calls.values())
+
+		tracemalloc.start()
+		before = tracemalloc.take_snapshot()
+		replayer.replay(serdisp, viaFramebuffer=viaFramebuffer)
+		peak = tracemalloc.get_traced_memory()[1]
+		allocations = _allocations(before, tracemalloc.take_snapshot())
+		tracemalloc.stop()
+	finally:
+		serdisp.close()
+
+	frames = max(1, replayer.frames)
+	return {
+		"fps": frames / elapsed if elapsed > 0 else float("inf"),
+		"callsPerFrame": calls / float(frames),
+		"allocsPerFrame": allocations / float(frames),
+		"peakKibPerFrame": peak / 1024.0,
+	}
+
+def compare(results, baseline, tolerance):
+	"""
+	Returns a list of human readable regressions of `results` against `baseline`.
+	"""
+	regressions = []
+	for name, result in sorted(results.items()):
+		if name not in baseline:
+			continue
+		base = baseline[name]
+		for key, higherIsBetter, format in _METRICS:
+			# Baselines saved by older versions lack some metrics
+			if key not in base:
+				continue
+			if higherIsBetter:
+				regressed = result[key] < base[key] * (1 - tolerance)
+			else:
+				regressed = result[key] > base[key] * (1 + tolerance)
+			if regressed:
+				regressions.append(("%s: " + format + ", baseline %.1f") % (name, result[key], base[key]))
+	return regressions
+
+def _printResult(name, result):
+	print("%-16s %9.1f fps %10.1f calls/frame %9.1f allocs/frame %9.1f peak KiB/frame" %
+		(name, result["fps"], result["callsPerFrame"], result["allocsPerFrame"], result["peakKibPerFrame"]))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks PySerdisp widgets against a virtual display.")
+	parser.add_argument("--font", help="TrueType font for the text scenarios")
+	parser.add_argument("--image", help="Image for the pixmap scenarios, a generated one by default")
+	parser.add_argument("--frames", type=int, default=100, help="Frames per scenario")
+	parser.add_argument("--packed", action="store_true", help="Use a framebuffer packed at the display depth")
+	parser.add_argument("--only", action="append", help="Run only the given scenario, may be repeated")
+	parser.add_argument("--baseline", default="benchmark_baseline.json", help="Baseline file")
+	parser.add_argument("--save", action="store_true", help="Store the results as new baseline")
+	parser.add_argument("--compare", action="store_true", help="Fail if results regressed against the baseline")
+	parser.add_argument("--replay", action="append", help="Replay a recording made with Serdisp.startRecording(), may be repeated")
+	parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative deviation from the baseline")
+	options = parser.parse_args(argv)
+
+	with tempfile.TemporaryDirectory() as tmp:
+		if not options.image:
+			options.image = _makeImage(tmp)
+
+		results = {}
+		for scenario in SCENARIOS:
+			if options.only and scenario.name not in options.only:
+				continue
+			if scenario.needsFont and not options.font:
+				print("%-16s skipped, needs --font" % scenario.name)
+				continue
+
+			results[scenario.name] = run(scenario, options)
+			_printResult(scenario.name, results[scenario.name])
+
+		# Recordings run once as recorded and once drawn into the framebuffer
+		# and flushed, which shows what the flush strategy makes of them.
+		for path in options.replay or []:
+			replayer = Replayer(path)
+			name = os.path.splitext(os.path.basename(path))[0]
+			results["replay-" + name] = runReplay(replayer, False)
+			_printResult("replay-" + name, results["replay-" + name])
+			results["replay-flush-" + name] = runReplay(replayer, True)
+			_printResult("replay-flush-" + name, results["replay-flush-" + name])
+
+	if options.compare:
+		if not os.path.isfile(options.baseline):
+			print("No baseline at", options.baseline)
+			return 1
+		with open(options.baseline) as f:
+			regressions = compare(results, json.load(f), options.tolerance)
+		for regression in regressions:
+			print("REGRESSION", regression)
+		if regressions:
+			return 1
+
+	if options.save:
+		with open(options.baseline, "w") as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+		print("Baseline written to", options.baseline)
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
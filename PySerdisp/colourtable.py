@@ -0,0 +1,141 @@
+# coding: utf-8
+
+from array import array
+from itertools import product
+
+from framebuffer import rgbToArgb
+from lrucache import LRUCache
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Channel values combined into the colours used to check whether the display's
+# colour translation works per channel: both ends, the middle and the steps
+# around them, so every combination of dark, mid and bright channels is tried.
+_PROBE_LEVELS = (0x00, 0x01, 0x3F, 0x40, 0x7F, 0x80, 0xBF, 0xC0, 0xFE, 0xFF)
+_PROBES = tuple(0xFF000000 | (r << 16) | (g << 8) | b for r, g, b in product(_PROBE_LEVELS, repeat=3))
+
+# Distinct colours remembered per display if they can't be tabulated
+TRANS_CACHE_SIZE = 4096
+
+class ColourTable:
+	"""
+	Lookup tables for translating colours into the display's hardware colour
+	values and back, built once per display from serdisp_transcolour,
+	serdisp_transgrey and serdisp_lookupcolour. Afterwards whole arrays of
+	ARGB, RGB or grey values are converted without calling into serdisplib.
+
+	Grey levels always go through a 256 entry table. ARGB values are split
+	into one table per channel if the display composes its hardware values
+	that way (RGB565, RGB888, ...). Otherwise, ex. for greyscale displays
+	that weigh the channels, colours are translated one by one and the
+	TRANS_CACHE_SIZE most recently used ones are remembered.
+	"""
+	def __init__(self, serdisp):
+		fn = serdisp.fn
+		disp = serdisp.disp
+		self.depth = serdisp.getDepth()
+
+		self.grey = [fn.transgrey(disp, g) for g in range(256)]
+		# Hardware values fit into a byte up to depth 8, bytes.translate() can do those
+		self.greyBytes = bytes(self.grey) if self.depth <= 8 else None
+
+		self.red = [fn.transcolour(disp, 0xFF000000 | (v << 16)) for v in range(256)]
+		self.green = [fn.transcolour(disp, 0xFF000000 | (v << 8)) for v in range(256)]
+		self.blue = [fn.transcolour(disp, 0xFF000000 | v) for v in range(256)]
+		self.__transCache = LRUCache(TRANS_CACHE_SIZE)
+		self.separable = self.__checkSeparable(fn, disp)
+
+		# The reverse direction can only be tabulated for small depths
+		self.lookup = None
+		if self.depth <= 8:
+			self.lookup = [fn.lookupcolour(disp, sdcol) for sdcol in range(1 << self.depth)]
+		self.__lookupCache = LRUCache(TRANS_CACHE_SIZE)
+		self.__fn = fn
+		self.__disp = disp
+
+	def __checkSeparable(self, fn, disp):
+		for argb in _PROBES:
+			if fn.transcolour(disp, argb) != self.__transSeparable(argb):
+				return False
+		return True
+
+	def __transSeparable(self, argb):
+		return self.red[(argb >> 16) & 0xFF] | self.green[(argb >> 8) & 0xFF] | self.blue[argb & 0xFF]
+
+	def transColour(self, argb):
+		"""
+		Returns the hardware colour value for a single ARGB value.
+		"""
+		if self.separable:
+			return self.__transSeparable(argb)
+
+		return self.__transCache.get(argb, self.__transOne)
+
+	def __transOne(self, argb):
+		return self.__fn.transcolour(self.__disp, argb)
+
+	def lookupColour(self, sdcol):
+		"""
+		Returns the ARGB value for a single hardware colour value.
+		"""
+		if self.lookup is not None:
+			return self.lookup[sdcol]
+
+		return self.__lookupCache.get(sdcol, self.__lookupOne)
+
+	def __lookupOne(self, sdcol):
+		return self.__fn.lookupcolour(self.__disp, sdcol)
+
+	def transColours(self, argbValues):
+		"""
+		Translates a buffer or sequence of ARGB values. Returns an array
+		of hardware colour values.
+		"""
+		if numpy is not None and self.separable:
+			values = numpy.asarray(argbValues, dtype=numpy.uint32)
+			red = numpy.asarray(self.red, dtype=numpy.uint32)
+			green = numpy.asarray(self.green, dtype=numpy.uint32)
+			blue = numpy.asarray(self.blue, dtype=numpy.uint32)
+			result = red[(values >> 16) & 0xFF] | green[(values >> 8) & 0xFF] | blue[values & 0xFF]
+			return array("I", result.tobytes())
+
+		if numpy is not None:
+			# Translate every distinct colour once, then scatter the results
+			values = numpy.asarray(argbValues, dtype=numpy.uint32)
+			distinct, inverse = numpy.unique(values, return_inverse=True)
+			translated = numpy.array([self.transColour(int(v)) for v in distinct], dtype=numpy.uint32)
+			return array("I", translated[inverse].tobytes())
+
+		trans = self.transColour
+		return array("I", [trans(argb) for argb in argbValues])
+
+	def transGreys(self, greys):
+		"""
+		Translates a bytes-like object of grey levels. Returns bytes up to
+		depth 8, an array of hardware colour values otherwise.
+		"""
+		if self.greyBytes is not None:
+			return bytes(greys).translate(self.greyBytes)
+		table = self.grey
+		return array("I", [table[g] for g in bytes(greys)])
+
+	def transRgb(self, rgb):
+		"""
+		Translates a bytes-like object of packed (r, g, b) bytes.
+		"""
+		return self.transColours(rgbToArgb(rgb))
+
+	def lookupColours(self, sdcols):
+		"""
+		Translates a sequence of hardware colour values back into an array of
+		ARGB values.
+		"""
+		if numpy is not None and self.lookup is not None:
+			table = numpy.asarray(self.lookup, dtype=numpy.uint32)
+			return array("I", table[numpy.asarray(sdcols, dtype=numpy.intp)].tobytes())
+
+		lookup = self.lookupColour
+		return array("I", [lookup(sdcol) for sdcol in sdcols])
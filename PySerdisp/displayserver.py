@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Shares one display between several processes. The server owns the
+Serdisp and listens on a Unix domain socket, every client gets a region of
+the display and sends what changed in it. The server composites the
+regions into its framebuffer and flushes at most `fps` times per second.
+
+	python displayserver.py --socket /tmp/serdisp.sock --device USB:7c0/1501 --model CTINCLUD
+
+	client = DisplayClient("/tmp/serdisp.sock", region=(0, 0, 120, 64))
+	clock = Text(client, (2, 2), "font.ttf", 24, "12:00")
+	clock.draw()
+	client.flush()
+
+Messages are an opcode and the payload length followed by the payload, all
+little endian:
+
+	HELLO	client -> server	region x, y, width, height (width 0: whole display)
+	INFO	server -> client	region width, height, display depth, colours
+	REGION	client -> server	x, y, width, height within the region, then the ARGB pixels
+"""
+
+import argparse
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from framebuffer import Framebuffer, packColour, packGrey, WHITE
+
+_MESSAGE = struct.Struct("<BI")
+_HELLO = struct.Struct("<iiII")
+_INFO = struct.Struct("<IIII")
+_REGION = struct.Struct("<HHHH")
+
+HELLO = 1
+INFO = 2
+REGION = 3
+
+def _littleEndian(values):
+	if sys.byteorder != "little":
+		values.byteswap()
+	return values
+
+def _send(sock, opcode, payload):
+	sock.sendall(_MESSAGE.pack(opcode, len(payload)) + payload)
+
+def _receive(stream):
+	"""
+	Reads one message from a file-like `stream`. Returns (opcode, payload)
+	or None at the end of the stream.
+	"""
+	header = stream.read(_MESSAGE.size)
+	if len(header) < _MESSAGE.size:
+		return None
+	opcode, length = _MESSAGE.unpack(header)
+	payload = stream.read(length)
+	if len(payload) < length:
+		return None
+	return opcode, payload
+
+class _Handler(socketserver.StreamRequestHandler):
+	def handle(self):
+		server = self.server.displayServer
+		message = _receive(self.rfile)
+		if message is None or message[0] != HELLO or len(message[1]) != _HELLO.size:
+			return
+
+		region = server.grantRegion(*_HELLO.unpack(message[1]))
+		serdisp = server.serdisp
+		_send(self.request, INFO, _INFO.pack(region[2], region[3], serdisp.getDepth(), serdisp.getColours()))
+		server.clients += 1
+		try:
+			while True:
+				message = _receive(self.rfile)
+				if message is None:
+					return
+				opcode, payload = message
+				if opcode != REGION:
+					continue
+				if len(payload) < _REGION.size:
+					print("Warning: dropped a malformed region update")
+					continue
+				x, y, width, height = _REGION.unpack_from(payload)
+				if len(payload) - _REGION.size != width * height * 4:
+					print("Warning: dropped a region update of %ix%i pixels with %i bytes" %
+						(width, height, len(payload) - _REGION.size))
+					continue
+				pixels = _littleEndian(array("I", payload[_REGION.size:]))
+				server.composite(region, x, y, width, height, pixels)
+		finally:
+			server.clients -= 1
+
+def _removeStaleSocket(path):
+	"""
+	Removes the socket a server that didn't shut down cleanly left at
+	`path`. Raises if something else is there or a server still listens.
+	"""
+	try:
+		mode = os.stat(path).st_mode
+	except FileNotFoundError:
+		return
+	if not stat.S_ISSOCK(mode):
+		raise Exception("%s exists and is not a socket" % path)
+
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(path)
+	except ConnectionRefusedError:
+		os.unlink(path)
+		return
+	finally:
+		probe.close()
+	raise Exception("Another display server is listening on %s" % path)
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+class DisplayServer:
+	"""
+	Owns `serdisp` and serves its display to DisplayClients on the Unix
+	socket `path`. Nothing else may draw on the display while it runs.
+	"""
+	def __init__(self, serdisp, path, fps=20):
+		self.serdisp = serdisp
+		self.path = path
+		self.interval = 1.0 / fps
+		self.clients = 0
+		self.framesFlushed = 0
+		self.error = None
+
+		self.__dirty = False
+		self.__running = True
+		self.__serving = False
+		self.__condition = threading.Condition()
+		# The flush thread sends this copy so clients can go on compositing meanwhile
+		self.__frame = serdisp.framebuffer.copy()
+
+		_removeStaleSocket(path)
+		self.__server = _Server(path, _Handler)
+		self.__server.displayServer = self
+		self.__flushThread = threading.Thread(target=self.__flushLoop, name="DisplayServer flush", daemon=True)
+		self.__flushThread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.stop()
+
+	def grantRegion(self, x, y, width, height):
+		"""
+		Returns the (x, y, width, height) region a client asking for the given
+		one gets, clipped to the display. A width or height of 0 asks for the
+		whole display.
+		"""
+		displayWidth = self.serdisp.getWidth()
+		displayHeight = self.serdisp.getHeight()
+		if width == 0 or height == 0:
+			return (0, 0, displayWidth, displayHeight)
+		x0 = min(max(0, x), displayWidth)
+		y0 = min(max(0, y), displayHeight)
+		return (x0, y0, min(displayWidth, x + width) - x0, min(displayHeight, y + height) - y0)
+
+	def composite(self, region, x, y, width, height, pixels):
+		"""
+		Copies an update of a client into the framebuffer, clipped to the
+		client's region, and schedules a flush.
+		"""
+		framebuffer = self.serdisp.framebuffer
+		with self.__condition:
+			framebuffer.setClip(*region)
+			try:
+				framebuffer.blitArgb(region[0] + x, region[1] + y, width, height, pixels)
+			finally:
+				framebuffer.resetClip()
+			self.__dirty = True
+			self.__condition.notify_all()
+
+	def __flushLoop(self):
+		while True:
+			with self.__condition:
+				while self.__running and not self.__dirty:
+					self.__condition.wait()
+				if not self.__running:
+					return
+				self.__frame.copyFrom(self.serdisp.framebuffer)
+				self.__dirty = False
+
+			start = time.monotonic()
+			try:
+				self.serdisp.flush(framebuffer=self.__frame)
+			except Exception as e:
+				self.error = e
+				print("Warning: display server flush failed:", e)
+				return
+			self.framesFlushed += 1
+
+			# Updates arriving meanwhile end up in the next frame
+			remaining = self.interval - (time.monotonic() - start)
+			if remaining > 0:
+				time.sleep(remaining)
+
+	def serveForever(self):
+		self.__serving = True
+		self.__server.serve_forever()
+
+	def start(self):
+		"""
+		Serves clients from a background thread.
+		"""
+		self.__serving = True
+		thread = threading.Thread(target=self.__server.serve_forever, name="DisplayServer", daemon=True)
+		thread.start()
+
+	def stop(self):
+		# shutdown() waits for serve_forever() and would block if it never ran
+		if self.__serving:
+			self.__server.shutdown()
+		self.__server.server_close()
+		with self.__condition:
+			self.__running = False
+			self.__condition.notify_all()
+		self.__flushThread.join()
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+class DisplayClient:
+	"""
+	Draws into a region of a display owned by a DisplayServer. Mirrors the
+	drawing part of Serdisp, so widgets can draw on it: getWidth() and
+	getHeight() return the size of the region and coordinates are relative
+	to it. flush() sends what changed since the last flush as one update.
+	"""
+	def __init__(self, path, region=(0, 0, 0, 0)):
+		self.path = path
+		self.turnOffOnQuit = False
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(path)
+		self.__stream = self.sock.makefile("rb")
+
+		_send(self.sock, HELLO, _HELLO.pack(*region))
+		message = _receive(self.__stream)
+		if message is None or message[0] != INFO:
+			raise Exception("Display server at %s didn't answer" % path)
+		self.width, self.height, self.depth, self.colours = _INFO.unpack(message[1])
+
+		self.framebuffer = Framebuffer(self.width, self.height)
+		# What the server has according to the last flush()
+		self.shadow = self.framebuffer.copy()
+		self.clear()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def getWidth(self):
+		return self.width
+
+	def getHeight(self):
+		return self.height
+
+	def getDepth(self):
+		return self.depth
+
+	def getColours(self):
+		return self.colours
+
+	def setColour(self, pos, colour):
+		self.framebuffer.setPixel(pos, packColour(colour))
+
+	def setGrey(self, pos, grey):
+		if grey < 0 or grey > 255:
+			raise Exception("Grey value must be within [0, 255]")
+		self.framebuffer.setPixel(pos, packGrey(grey))
+
+	def clear(self):
+		self.framebuffer.fill(WHITE)
+		self.flush(full=True)
+
+	def update(self):
+		self.flush()
+
+	def flush(self, full=False):
+		"""
+		Sends the smallest rectangle holding all pixels that changed since
+		the last flush (everything with full=True) to the server. Returns
+		the number of changed pixels.
+		"""
+		if full:
+			x0, y0, x1, y1 = 0, 0, self.width, self.height
+			changed = self.width * self.height
+		else:
+			changes = self.framebuffer.diff(self.shadow)
+			if not changes:
+				return 0
+			changed = len(changes)
+			xs = [change[0] for change in changes]
+			x0, x1 = min(xs), max(xs) + 1
+			y0, y1 = changes[0][1], changes[-1][1] + 1
+
+		pixels = self.framebuffer.pixels
+		rows = array("I")
+		for y in range(y0, y1):
+			rows.frombytes(pixels[y * self.width + x0:y * self.width + x1].cast("B"))
+		_send(self.sock, REGION, _REGION.pack(x0, y0, x1 - x0, y1 - y0) + _littleEndian(rows).tobytes())
+		self.shadow.copyFrom(self.framebuffer)
+		return changed
+
+	def close(self):
+		self.__stream.close()
+		self.sock.close()
+
+	def quit(self):
+		self.close()
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Shares a display between processes over a Unix socket.")
+	parser.add_argument("--socket", default="/tmp/serdisp.sock", help="Socket to listen on")
+	parser.add_argument("--device", help="serdisplib device, ex. USB:7c0/1501")
+	parser.add_argument("--model", help="serdisplib display model, ex. CTINCLUD")
+	parser.add_argument("--options", default="", help="serdisplib display options")
+	parser.add_argument("--virtual", metavar="WIDTHxHEIGHTxDEPTH", help="Serve a VirtualDisplay instead, ex. 240x128x1")
+	parser.add_argument("--fps", type=float, default=20, help="Most frames per second sent to the display")
+	options = parser.parse_args(argv)
+
+	from pyserdisp import Serdisp
+
+	if options.virtual:
+		from virtualdisplay import VirtualDisplay
+		width, height, depth = (int(value) for value in options.virtual.split("x"))
+		serdisp = Serdisp("VIRTUAL", "VIRTUAL", backend=VirtualDisplay(width, height, depth))
+	elif options.device and options.model:
+		serdisp = Serdisp(options.device, options.model, options.options)
+	else:
+		parser.error("either --device and --model or --virtual are needed")
+
+	with serdisp:
+		server = DisplayServer(serdisp, options.socket, options.fps)
+		try:
+			server.serveForever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.stop()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
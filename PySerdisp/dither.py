@@ -0,0 +1,165 @@
+# coding: utf-8
+
+"""
+Quantizes grey images (one byte per pixel, row by row) to the levels a
+display of a given depth can show. The result uses the same grey scale as
+the input, ex. 0, 85, 170 and 255 for a depth of 2, so it can be drawn
+with Framebuffer.blitGrey().
+"""
+
+import math
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+MODES = ("threshold", "ordered", "floydsteinberg")
+
+# 8x8 Bayer matrix for ordered dithering
+_BAYER = (
+	( 0, 32,  8, 40,  2, 34, 10, 42),
+	(48, 16, 56, 24, 50, 18, 58, 26),
+	(12, 44,  4, 36, 14, 46,  6, 38),
+	(60, 28, 52, 20, 62, 30, 54, 22),
+	( 3, 35, 11, 43,  1, 33,  9, 41),
+	(51, 19, 59, 27, 49, 17, 57, 25),
+	(15, 47,  7, 39, 13, 45,  5, 37),
+	(63, 31, 55, 23, 61, 29, 53, 21),
+)
+
+def _levels(depth):
+	return (1 << min(depth, 8)) - 1
+
+def _quantize(value, levels):
+	"""
+	Returns the representable grey closest to `value`.
+	"""
+	value = min(255, max(0, value))
+	return ((value * levels + 127) // 255) * 255 // levels
+
+def dither(grey, width, height, depth, mode="threshold"):
+	"""
+	Quantizes `grey` to what a display of `depth` can show using `mode`,
+	one of MODES. Returns bytes.
+	"""
+	if len(grey) != width * height:
+		raise ValueError("Expected %i grey values, got %i" % (width * height, len(grey)))
+
+	if mode == "threshold":
+		return threshold(grey, depth)
+	elif mode == "ordered":
+		return ordered(grey, width, height, depth)
+	elif mode == "floydsteinberg":
+		return floydSteinberg(grey, width, height, depth)
+	raise ValueError("Unknown dither mode: %s, use one of %s" % (mode, ", ".join(MODES)))
+
+def threshold(grey, depth):
+	"""
+	Rounds every pixel to the closest level.
+	"""
+	levels = _levels(depth)
+	table = bytes(_quantize(g, levels) for g in range(256))
+	return bytes(grey).translate(table)
+
+def ordered(grey, width, height, depth):
+	"""
+	Ordered dithering with an 8x8 Bayer matrix.
+	"""
+	levels = _levels(depth)
+	step = 255.0 / levels
+
+	if numpy is not None:
+		pixels = numpy.frombuffer(bytes(grey), dtype=numpy.uint8).reshape(height, width)
+		bias = (numpy.array(_BAYER, dtype=numpy.float64) + 0.5) / 64.0 - 0.5
+		bias = numpy.tile(bias, ((height + 7) // 8, (width + 7) // 8))[:height, :width]
+		values = numpy.clip(numpy.floor(pixels + bias * step + 0.5), 0, 255).astype(numpy.int32)
+		quantized = ((values * levels + 127) // 255) * 255 // levels
+		return quantized.astype(numpy.uint8).tobytes()
+
+	# Each position in the matrix gets its own translation table, rows are
+	# then translated in 8 interleaved strides.
+	tables = [[bytes(_quantize(int(math.floor(g + ((_BAYER[r][c] + 0.5) / 64.0 - 0.5) * step + 0.5)), levels)
+		for g in range(256)) for c in range(8)] for r in range(8)]
+
+	grey = bytes(grey)
+	out = bytearray(len(grey))
+	for y in range(height):
+		row = y * width
+		line = grey[row:row + width]
+		result = bytearray(width)
+		for c in range(min(8, width)):
+			result[c::8] = line[c::8].translate(tables[y % 8][c])
+		out[row:row + width] = result
+	return bytes(out)
+
+def floydSteinberg(grey, width, height, depth):
+	"""
+	Floyd-Steinberg error diffusion. Without NumPy this runs pixel by pixel,
+	row by row, with the error of the current and the next row kept in lists.
+	"""
+	levels = _levels(depth)
+	table = [_quantize(g, levels) for g in range(256)]
+	grey = bytes(grey)
+	if numpy is not None and width and height:
+		return _floydSteinbergNumpy(grey, width, height, table)
+
+	out = bytearray(len(grey))
+
+	# Errors are kept in 1/16 units, one spare slot on either side of the row
+	current = [0] * (width + 2)
+	for y in range(height):
+		below = [0] * (width + 2)
+		row = y * width
+		for x in range(width):
+			value = grey[row + x] + (current[x + 1] >> 4)
+			value = 0 if value < 0 else (255 if value > 255 else value)
+			quantized = table[value]
+			out[row + x] = quantized
+			error = value - quantized
+			current[x + 2] += error * 7
+			below[x] += error * 3
+			below[x + 1] += error * 5
+			below[x + 2] += error
+		current = below
+	return bytes(out)
+
+def _floydSteinbergNumpy(grey, width, height, table):
+	"""
+	Pixel (x, y) only depends on pixels with a smaller x + 2 * y, so all
+	pixels with the same x + 2 * y are diffused at once. The image is
+	skewed so that these diagonals become rows: pixel (x, y) is kept at
+	[x + 2 * y, y] and its neighbours receiving its error are at
+	[t + 1, y] (right), [t + 1, y + 1] (below left), [t + 2, y + 1] (below)
+	and [t + 3, y + 1] (below right). Gives the same result as the loop.
+	"""
+	steps = width + 2 * (height - 1)
+	pixels = numpy.frombuffer(grey, dtype=numpy.uint8).reshape(height, width)
+	skewed = numpy.zeros((steps, height), dtype=numpy.int64)
+	for y in range(height):
+		skewed[2 * y:2 * y + width, y] = pixels[y]
+
+	# Values off by the accumulated error are looked up with an offset of
+	# 256, which also takes care of clamping them to [0, 255]
+	clamped = numpy.clip(numpy.arange(768) - 256, 0, 255)
+	quantize = numpy.array(table, dtype=numpy.int64)[clamped]
+	remainder = clamped - quantize
+
+	# Errors in 1/16 units as in the loop, a spare column for the last row
+	errors = numpy.zeros((steps + 3, height + 1), dtype=numpy.int64)
+	quantized = numpy.zeros((steps, height), dtype=numpy.uint8)
+	for t in range(steps):
+		y0 = max(0, (t - width + 2) // 2)
+		y1 = min(height, t // 2 + 1)
+		value = skewed[t, y0:y1] + (errors[t, y0:y1] >> 4) + 256
+		quantized[t, y0:y1] = quantize[value]
+		error = remainder[value]
+		errors[t + 1, y0:y1] += error * 7
+		errors[t + 1, y0 + 1:y1 + 1] += error * 3
+		errors[t + 2, y0 + 1:y1 + 1] += error * 5
+		errors[t + 3, y0 + 1:y1 + 1] += error
+
+	out = numpy.empty((height, width), dtype=numpy.uint8)
+	for y in range(height):
+		out[y] = quantized[2 * y:2 * y + width, y]
+	return out.tobytes()
@@ -0,0 +1,125 @@
+# coding: utf-8
+
+import threading
+import time
+
+class BackgroundFlusher:
+	"""
+	Double buffering for a Serdisp: the application keeps drawing into
+	serdisp.framebuffer (the back buffer) while a background thread pushes
+	the previously presented frame to the display.
+
+		with BackgroundFlusher(serdisp, dropFrames=True) as flusher:
+			while True:
+				drawWidgets()
+				flusher.present()
+
+	present() hands the current back buffer over at a frame boundary. It
+	copies the frame instead of swapping buffers, so the back buffer keeps
+	its contents and widgets can go on drawing incrementally.
+	If the flusher hasn't picked up the previous frame yet, present() either
+	waits for it or, with dropFrames=True, replaces that frame with the new
+	one (counted in framesDropped).
+
+	While the flusher runs, only it may talk to the display. Don't call
+	flush(), update(), clear() and the like directly.
+	"""
+	def __init__(self, serdisp, dropFrames=False):
+		self.serdisp = serdisp
+		self.dropFrames = dropFrames
+		self.framesPresented = 0
+		self.framesFlushed = 0
+		self.framesDropped = 0
+		# Time the last flush took in seconds
+		self.lastFlushTime = 0.0
+		self.error = None
+
+		self.__pending = serdisp.framebuffer.copy()
+		self.__sending = serdisp.framebuffer.copy()
+		self.__hasPending = False
+		self.__busy = False
+		self.__running = True
+		self.__condition = threading.Condition()
+		self.__thread = threading.Thread(target=self.__run, name="BackgroundFlusher", daemon=True)
+		self.__thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.stop()
+
+	def present(self):
+		"""
+		Queues the current contents of the back buffer for flushing.
+		"""
+		with self.__condition:
+			self.__raiseError()
+			if self.__hasPending:
+				if self.dropFrames:
+					self.framesDropped += 1
+				else:
+					while self.__hasPending and self.error is None:
+						self.__condition.wait()
+					self.__raiseError()
+
+			self.__pending.copyFrom(self.serdisp.framebuffer)
+			self.__hasPending = True
+			self.framesPresented += 1
+			self.__condition.notify_all()
+
+	def wait(self):
+		"""
+		Blocks until every presented frame is on the display.
+		"""
+		with self.__condition:
+			while (self.__hasPending or self.__busy) and self.error is None:
+				self.__condition.wait()
+			self.__raiseError()
+
+	def stop(self):
+		"""
+		Flushes what has been presented so far and stops the thread.
+		"""
+		try:
+			self.wait()
+		finally:
+			with self.__condition:
+				self.__running = False
+				self.__condition.notify_all()
+			self.__thread.join()
+
+	def __raiseError(self):
+		if self.error is not None:
+			raise RuntimeError("Background flush failed") from self.error
+
+	def __run(self):
+		while True:
+			with self.__condition:
+				while self.__running and not self.__hasPending:
+					self.__condition.wait()
+				if not self.__hasPending:
+					return
+
+				# The pending frame becomes the one being sent, the former
+				# one is free to take the next frame.
+				self.__pending, self.__sending = self.__sending, self.__pending
+				self.__hasPending = False
+				self.__busy = True
+				self.__condition.notify_all()
+
+			start = time.monotonic()
+			try:
+				self.serdisp.flush(framebuffer=self.__sending)
+			except Exception as e:
+				with self.__condition:
+					self.error = e
+					self.__busy = False
+					self.__condition.notify_all()
+				return
+
+			with self.__condition:
+				self.lastFlushTime = time.monotonic() - start
+				self.framesFlushed += 1
+				self.__busy = False
+				self.__condition.notify_all()
@@ -0,0 +1,244 @@
+# coding: utf-8
+
+import sys
+from array import array
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+WHITE = 0xFFFFFFFF
+BLACK = 0xFF000000
+
+# Rows are compared in chunks of this many pixels before looking at single pixels
+_DIFF_CHUNK = 32
+
+# Byte offsets of the channels inside a native 32bit ARGB value
+if sys.byteorder == "little":
+	_B, _G, _R, _A = 0, 1, 2, 3
+else:
+	_A, _R, _G, _B = 0, 1, 2, 3
+
+def packColour(colour):
+	"""
+	Returns the 32bit ARGB value for an (a, r, g, b) or (r, g, b) tuple.
+	Integers are assumed to be ARGB values already and returned as they are.
+	"""
+	if isinstance(colour, int):
+		return colour & 0xFFFFFFFF
+
+	if len(colour) == 4:
+		a, r, g, b = colour
+	elif len(colour) == 3:
+		# Assuming alpha as fully opaque
+		a = 0xFF
+		r, g, b = colour
+	else:
+		raise ValueError("Colour tuples should be [ARGB], [RGB] formatted. Is:", colour)
+
+	return (a << 24) | (r << 16) | (g << 8) | b
+
+def packGrey(grey):
+	"""
+	Returns the opaque 32bit ARGB value for a grey level within [0, 255].
+	"""
+	return 0xFF000000 | (grey << 16) | (grey << 8) | grey
+
+def greyToArgb(grey):
+	"""
+	Converts a bytes-like object of grey levels into an array of opaque
+	ARGB values. Works on whole rows at once instead of pixel by pixel.
+	"""
+	count = len(grey)
+	out = bytearray(count * 4)
+	out[_B::4] = grey
+	out[_G::4] = grey
+	out[_R::4] = grey
+	out[_A::4] = b"\xff" * count
+	return memoryview(out).cast("I")
+
+def rgbToArgb(rgb):
+	"""
+	Converts a bytes-like object of packed (r, g, b) bytes into an array of
+	opaque ARGB values.
+	"""
+	count = len(rgb) // 3
+	out = bytearray(count * 4)
+	out[_R::4] = rgb[0::3]
+	out[_G::4] = rgb[1::3]
+	out[_B::4] = rgb[2::3]
+	out[_A::4] = b"\xff" * count
+	return memoryview(out).cast("I")
+
+class BaseFramebuffer:
+	"""
+	What all framebuffers share: the size, the clip rectangle and the
+	generation, which is bumped whenever the whole framebuffer is
+	overwritten (fill(), copyFrom()) and lets widgets tell whether what they
+	drew is still there.
+	"""
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.generation = 0
+		self.resetClip()
+
+	def setClip(self, x, y, width, height):
+		"""
+		Restricts all drawing except fill() to the given rectangle until
+		resetClip() is called.
+		"""
+		self.clip = (max(0, x), max(0, y),
+			min(self.width, x + width), min(self.height, y + height))
+
+	def resetClip(self):
+		self.clip = (0, 0, self.width, self.height)
+
+	def clipped(self, x, y, width, height):
+		"""
+		Intersects the given rectangle with the clip rectangle.
+		Returns (x0, y0, x1, y1) or None if nothing is left.
+		"""
+		x0 = max(self.clip[0], x)
+		y0 = max(self.clip[1], y)
+		x1 = min(self.clip[2], x + width)
+		y1 = min(self.clip[3], y + height)
+		if x0 >= x1 or y0 >= y1:
+			return None
+		return (x0, y0, x1, y1)
+
+class Framebuffer(BaseFramebuffer):
+	"""
+	Python-side copy of the display contents that widgets draw into.
+	Pixels are stored row by row as 32bit ARGB values. Nothing in here
+	talks to serdisplib, Serdisp.flush() pushes the contents to the device.
+
+	`buffer` lets the framebuffer live in memory owned by someone else, ex.
+	a shared memory segment. It has to be writable and hold at least
+	width * height * 4 bytes, its contents are used as they are.
+	"""
+	def __init__(self, width, height, buffer=None):
+		BaseFramebuffer.__init__(self, width, height)
+		if buffer is None:
+			self.pixels = memoryview(bytearray(width * height * 4)).cast("I")
+			self.fill(WHITE)
+		else:
+			self.pixels = memoryview(buffer).cast("B")[:width * height * 4].cast("I")
+
+	def setPixel(self, pos, argb):
+		x, y = pos
+		if self.clip[0] <= x < self.clip[2] and self.clip[1] <= y < self.clip[3]:
+			self.pixels[y * self.width + x] = argb
+
+	def getPixel(self, pos):
+		return self.pixels[pos[1] * self.width + pos[0]]
+
+	def fill(self, argb):
+		self.generation += 1
+		self.pixels[:] = array("I", [argb]) * len(self.pixels)
+
+	def fillRect(self, x, y, width, height, argb):
+		"""
+		Fills the given rectangle, clipped to the clip rectangle.
+		"""
+		clipped = self.clipped(x, y, width, height)
+		if not clipped:
+			return
+
+		x0, y0, x1, y1 = clipped
+		if x0 == 0 and x1 == self.width:
+			# Whole rows are one contiguous block
+			self.pixels[y0 * self.width:y1 * self.width] = array("I", [argb]) * ((y1 - y0) * self.width)
+			return
+
+		row = array("I", [argb]) * (x1 - x0)
+		for dy in range(y0, y1):
+			start = dy * self.width + x0
+			self.pixels[start:start + len(row)] = row
+
+	def blitArgb(self, x, y, width, height, data, stride=None):
+		"""
+		Copies a width * height block of ARGB values (row by row, any
+		buffer of unsigned ints) to (x, y), clipped to the clip rectangle.
+		Rows in `data` are `stride` values apart, `width` by default.
+		"""
+		clipped = self.clipped(x, y, width, height)
+		if not clipped:
+			return
+
+		x0, y0, x1, y1 = clipped
+		data = memoryview(data).cast("B").cast("I")
+		stride = width if stride is None else stride
+		span = x1 - x0
+		for dy in range(y0, y1):
+			src = (dy - y) * stride + (x0 - x)
+			dst = dy * self.width + x0
+			self.pixels[dst:dst + span] = data[src:src + span]
+
+	def blitGrey(self, x, y, width, height, data, stride=None):
+		"""
+		Like blitArgb(), but takes one grey level byte per pixel.
+		"""
+		clipped = self.clipped(x, y, width, height)
+		if not clipped:
+			return
+
+		x0, y0, x1, y1 = clipped
+		data = memoryview(data).cast("B")
+		stride = width if stride is None else stride
+		span = x1 - x0
+		for dy in range(y0, y1):
+			src = (dy - y) * stride + (x0 - x)
+			dst = dy * self.width + x0
+			self.pixels[dst:dst + span] = greyToArgb(data[src:src + span])
+
+	def copy(self):
+		other = Framebuffer(self.width, self.height)
+		other.pixels[:] = self.pixels
+		return other
+
+	def copyFrom(self, other):
+		self.generation += 1
+		self.pixels[:] = other.pixels
+
+	def pixelList(self):
+		"""
+		Returns (x, y, argb) tuples for all pixels.
+		"""
+		pixels = self.pixels
+		width = self.width
+		return [(i % width, i // width, pixels[i]) for i in range(len(pixels))]
+
+	def diff(self, other):
+		"""
+		Returns a list of (x, y, argb) tuples for all pixels that differ
+		from the equally sized framebuffer `other`, argb being our value.
+		"""
+		if numpy is not None:
+			mine = numpy.frombuffer(self.pixels, dtype=numpy.uint32)
+			theirs = numpy.frombuffer(other.pixels, dtype=numpy.uint32)
+			changed = numpy.flatnonzero(mine != theirs)
+			ys, xs = numpy.divmod(changed, self.width)
+			return list(zip(xs.tolist(), ys.tolist(), mine[changed].tolist()))
+
+		# Identical rows are skipped with a single C-level comparison,
+		# changed rows are narrowed down chunk by chunk.
+		changed = []
+		mine = self.pixels
+		theirs = other.pixels
+		width = self.width
+		for y in range(self.height):
+			row = y * width
+			if mine[row:row + width] == theirs[row:row + width]:
+				continue
+
+			for chunk in range(row, row + width, _DIFF_CHUNK):
+				end = min(chunk + _DIFF_CHUNK, row + width)
+				if mine[chunk:end] == theirs[chunk:end]:
+					continue
+				for i in range(chunk, end):
+					if mine[i] != theirs[i]:
+						changed.append((i - row, y, mine[i]))
+
+		return changed
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Cache file layout: magic, width, height, bytes per pixel, padding to keep
+# the pixel data 4-byte aligned, then the pixels row by row.
+_HEADER = struct.Struct("<4sIIB3x")
+_MAGIC = b"PXC1"
+
+# Converted images kept in memory, shared by all pixmaps of the process
+# (and thereby all displays). Holds at most SHARED_SIZE images.
+SHARED_SIZE = 64
+_shared = OrderedDict()
+_sharedLock = threading.Lock()
+
+def cacheKey(path, depth, conversion):
+	"""
+	Returns the cache file name for an image. Touching or replacing the
+	source file, a different display depth or conversion result in a new key.
+	The name starts with a hash of the path and the modification time, so
+	store() can find the entries of older versions of the same image.
+	"""
+	path = os.path.realpath(path)
+	mtime = os.stat(path).st_mtime_ns
+	pathHash = hashlib.sha1(path.encode()).hexdigest()
+	variant = hashlib.sha1(("%i\0%s" % (depth, conversion)).encode()).hexdigest()[:16]
+	return "%s-%i-%s.pxc" % (pathHash, mtime, variant)
+
+def getShared(key):
+	"""
+	Returns (size, bytesPerPixel, data) of an image converted before in this
+	process or None.
+	"""
+	with _sharedLock:
+		entry = _shared.get(key)
+		if entry is not None:
+			_shared.move_to_end(key)
+		return entry
+
+def putShared(key, size, bytesPerPixel, data):
+	with _sharedLock:
+		_shared[key] = (size, bytesPerPixel, data)
+		_shared.move_to_end(key)
+		while len(_shared) > SHARED_SIZE:
+			_shared.popitem(last=False)
+
+def load(cacheDir, key):
+	"""
+	Maps a cached image into memory. Returns (size, bytesPerPixel, data) or
+	None if there is no usable cache file. `data` is a read-only memoryview
+	into the mapping, nothing is copied.
+	"""
+	try:
+		with open(os.path.join(cacheDir, key), "rb") as f:
+			mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	except (OSError, ValueError):
+		return None
+
+	if len(mapped) < _HEADER.size:
+		return None
+
+	magic, width, height, bytesPerPixel = _HEADER.unpack_from(mapped)
+	end = _HEADER.size + width * height * bytesPerPixel
+	if magic != _MAGIC or len(mapped) < end:
+		return None
+
+	data = memoryview(mapped)[_HEADER.size:end]
+	if bytesPerPixel == 4:
+		data = data.cast("I")
+	return ((width, height), bytesPerPixel, data)
+
+def store(cacheDir, key, size, bytesPerPixel, data):
+	"""
+	Writes a converted image to the cache. The file is replaced atomically,
+	so concurrent readers never see partial files. Failing to write the
+	cache isn't fatal, it just prints a warning.
+	"""
+	tmpPath = None
+	try:
+		os.makedirs(cacheDir, exist_ok=True)
+		fd, tmpPath = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+		with os.fdopen(fd, "wb") as f:
+			f.write(_HEADER.pack(_MAGIC, size[0], size[1], bytesPerPixel))
+			f.write(data)
+		os.replace(tmpPath, os.path.join(cacheDir, key))
+		_removeSuperseded(cacheDir, key)
+	except OSError as e:
+		print("Warning: Couldn't write image cache in", cacheDir)
+		print(e)
+		if tmpPath and os.path.exists(tmpPath):
+			os.remove(tmpPath)
+
+def _removeSuperseded(cacheDir, key):
+	"""
+	Removes the cache files of other versions (modification times) of the
+	image `key` belongs to. Other depths and conversions of the same version
+	stay, other displays may use them. Processes still mapping a removed
+	file keep their mapping.
+	"""
+	pathHash, mtime = key.split("-")[:2]
+	for name in os.listdir(cacheDir):
+		parts = name.split("-")
+		if name.endswith(".pxc") and len(parts) == 3 and parts[0] == pathHash and parts[1] != mtime:
+			try:
+				os.remove(os.path.join(cacheDir, name))
+			except FileNotFoundError:
+				pass
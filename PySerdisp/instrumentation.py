@@ -0,0 +1,100 @@
+# coding: utf-8
+
+import time
+from collections import Counter, namedtuple
+
+# Calls that are timed, the others are only counted
+TIMED = ("update", "rewrite", "clear")
+# Calls that write a single pixel
+PIXEL_WRITES = ("setpixel", "setcolour", "setgrey")
+
+CallTiming = namedtuple("CallTiming", "count total max")
+# Snapshot returned by Serdisp.stats(). calls maps serdisplib functions (as
+# in Serdisp.fn) to call counts, timings maps TIMED functions to CallTimings
+# in seconds. A frame ends with every update() or rewrite().
+Stats = namedtuple("Stats", "calls timings frames pixels lastFramePixels maxFramePixels")
+
+class Instrumentation:
+	"""
+	Counts and times the calls going through Serdisp.fn. wrap() replaces
+	the functions by counting versions, the unwrapped functions are used
+	again once instrumentation is switched off, so there is no cost at all
+	when it is not in use.
+
+	`hook`, if given, is called as hook(name, seconds, pixels) after every
+	TIMED call, `pixels` being the pixels written since the last frame for
+	update() and rewrite(), 0 for clear(). Use it to feed metrics exporters.
+	"""
+	def __init__(self, hook=None):
+		self.hook = hook
+		# The wrappers hold on to the counter, reset() clears it rather than replacing it
+		self.calls = Counter()
+		self.reset()
+
+	def reset(self):
+		self.calls.clear()
+		self.timings = {}
+		self.frames = 0
+		self.pixels = 0
+		self.framePixels = 0
+		self.lastFramePixels = 0
+		self.maxFramePixels = 0
+
+	def wrap(self, functions):
+		"""
+		Returns a dict of counting wrappers for the {name: function} dict `functions`.
+		"""
+		wrapped = {}
+		for name, func in functions.items():
+			if name in TIMED:
+				wrapped[name] = self.__timed(name, func)
+			elif name in PIXEL_WRITES:
+				wrapped[name] = self.__pixelWrite(name, func)
+			else:
+				wrapped[name] = self.__counted(name, func)
+		return wrapped
+
+	def __counted(self, name, func):
+		calls = self.calls
+		def call(*args):
+			calls[name] += 1
+			return func(*args)
+		return call
+
+	def __pixelWrite(self, name, func):
+		calls = self.calls
+		def call(*args):
+			calls[name] += 1
+			self.framePixels += 1
+			return func(*args)
+		return call
+
+	def __timed(self, name, func):
+		def call(*args):
+			start = time.perf_counter()
+			try:
+				return func(*args)
+			finally:
+				self.record(name, time.perf_counter() - start)
+		return call
+
+	def record(self, name, seconds):
+		self.calls[name] += 1
+		count, total, longest = self.timings.get(name, (0, 0.0, 0.0))
+		self.timings[name] = CallTiming(count + 1, total + seconds, max(longest, seconds))
+
+		pixels = 0
+		if name != "clear":
+			pixels = self.framePixels
+			self.frames += 1
+			self.pixels += pixels
+			self.lastFramePixels = pixels
+			self.maxFramePixels = max(self.maxFramePixels, pixels)
+			self.framePixels = 0
+
+		if self.hook is not None:
+			self.hook(name, seconds, pixels)
+
+	def snapshot(self):
+		return Stats(dict(self.calls), dict(self.timings), self.frames, self.pixels,
+			self.lastFramePixels, self.maxFramePixels)
@@ -0,0 +1,42 @@
+# coding: utf-8
+
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple("CacheInfo", "hits misses size maxsize")
+
+class LRUCache:
+	"""
+	A dictionary that holds at most `maxsize` entries and evicts the least
+	recently used one when it runs full. Counts hits and misses.
+	"""
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+
+	def get(self, key, compute):
+		"""
+		Returns the entry for `key`, calling `compute(key)` to create it if missing.
+		"""
+		try:
+			value = self._entries[key]
+		except KeyError:
+			self.misses += 1
+			value = compute(key)
+			self._entries[key] = value
+			if len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+			return value
+
+		self.hits += 1
+		self._entries.move_to_end(key)
+		return value
+
+	def clear(self):
+		self._entries.clear()
+		self.hits = 0
+		self.misses = 0
+
+	def info(self):
+		return CacheInfo(self.hits, self.misses, len(self._entries), self.maxsize)
@@ -0,0 +1,218 @@
+# coding: utf-8
+
+import threading
+import time
+
+class DisplayStats:
+	"""
+	Frame timing of one display as seen by the DisplayManager.
+	"""
+	def __init__(self):
+		self.frames = 0
+		self.skipped = 0
+		self.lastFrameTime = 0.0
+		self.totalFrameTime = 0.0
+		self.maxFrameTime = 0.0
+
+	def averageFrameTime(self):
+		return self.totalFrameTime / self.frames if self.frames else 0.0
+
+	def __repr__(self):
+		return "DisplayStats(frames=%i, skipped=%i, last=%.4fs, avg=%.4fs, max=%.4fs)" % (self.frames,
+			self.skipped, self.lastFrameTime, self.averageFrameTime(), self.maxFrameTime)
+
+class _Device:
+	"""
+	A display and the worker thread rendering its frames.
+	"""
+	def __init__(self, name, serdisp, render):
+		self.name = name
+		self.serdisp = serdisp
+		self.render = render
+		self.stats = DisplayStats()
+		self.error = None
+		self.busy = False
+		self.running = True
+		self.condition = threading.Condition()
+		self.thread = threading.Thread(target=self.run, name="Display %s" % name, daemon=True)
+		self.thread.start()
+
+	def submit(self):
+		"""
+		Starts a frame unless the previous one is still running.
+		Returns False if the display is busy or failed.
+		"""
+		with self.condition:
+			if self.busy or self.error is not None or not self.running:
+				self.stats.skipped += 1
+				return False
+			self.busy = True
+			self.condition.notify_all()
+			return True
+
+	def waitIdle(self, deadline):
+		with self.condition:
+			while self.busy:
+				remaining = None if deadline is None else deadline - time.monotonic()
+				if remaining is not None and remaining <= 0:
+					return False
+				self.condition.wait(remaining)
+			return True
+
+	def stop(self, timeout=None):
+		"""
+		Tells the worker thread to end after the current frame and waits at
+		most `timeout` seconds for it. Returns False if it is still running.
+		"""
+		with self.condition:
+			self.running = False
+			self.condition.notify_all()
+		self.thread.join(timeout)
+		return not self.thread.is_alive()
+
+	def run(self):
+		while True:
+			with self.condition:
+				while self.running and not self.busy:
+					self.condition.wait()
+				if not self.running:
+					return
+
+			start = time.monotonic()
+			error = None
+			try:
+				self.render()
+			except Exception as e:
+				error = e
+			elapsed = time.monotonic() - start
+
+			with self.condition:
+				if error is not None:
+					self.error = error
+				else:
+					self.stats.frames += 1
+					self.stats.lastFrameTime = elapsed
+					self.stats.totalFrameTime += elapsed
+					self.stats.maxFrameTime = max(self.stats.maxFrameTime, elapsed)
+				self.busy = False
+				self.condition.notify_all()
+
+class DisplayManager:
+	"""
+	Drives several displays in parallel, each from its own worker thread, so
+	one display's slow refresh doesn't hold up the others. serdisplib releases
+	the GIL while it talks to a device, so the transfers really overlap.
+
+		manager = DisplayManager()
+		manager.add("left", Serdisp("USB:7c0/1501", "CTINCLUD"))
+		manager.add("right", rightSerdisp, rightScene.render)
+		while True:
+			drawWidgets()
+			manager.refresh(timeout=0.1)
+
+	A display still busy with its previous frame skips the new one, a display
+	whose render function raised is left alone from then on (see failed()
+	and reset()). Fonts (textrenderer.get_font) and converted pixmaps are
+	shared process-wide, so displays showing the same content load it once.
+
+	Widgets of a display must only be touched while that display is idle,
+	refresh() returns with all displays idle unless a timeout hits.
+	"""
+	def __init__(self):
+		self.__devices = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def add(self, name, serdisp, render=None):
+		"""
+		Adds a display. `render` is called on the display's worker thread for
+		every frame, serdisp.flush by default.
+		"""
+		if name in self.__devices:
+			raise ValueError("Display already added: %s" % name)
+		self.__devices[name] = _Device(name, serdisp, render or serdisp.flush)
+		return serdisp
+
+	def remove(self, name, timeout=5.0):
+		"""
+		Removes a display and returns its Serdisp. Waits at most `timeout`
+		seconds for a frame still being rendered, a display hanging longer
+		keeps its (daemon) worker thread and must not be closed.
+		"""
+		device = self.__devices.pop(name)
+		if not device.stop(timeout):
+			self.__warnHung(device, timeout)
+		return device.serdisp
+
+	def __warnHung(self, device, timeout):
+		print("Warning: display %s didn't finish its frame within %.1fs, leaving its thread behind" %
+			(device.name, timeout))
+
+	def names(self):
+		return list(self.__devices.keys())
+
+	def get(self, name):
+		return self.__devices[name].serdisp
+
+	def refresh(self, timeout=1.0):
+		"""
+		Starts a frame on every idle, healthy display and waits until they are
+		done or `timeout` seconds have passed (None waits for ever). Returns
+		the names of the displays that finished their frame in time. A display
+		still busy afterwards skips the following refreshes, so a hung one
+		delays only the first of them.
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		started = [device for device in self.__devices.values() if device.submit()]
+
+		done = []
+		for device in started:
+			if device.waitIdle(deadline) and device.error is None:
+				done.append(device.name)
+		return done
+
+	def stats(self):
+		"""
+		Returns {name: DisplayStats} for all displays.
+		"""
+		return dict((name, device.stats) for name, device in self.__devices.items())
+
+	def failed(self):
+		"""
+		Returns {name: exception} of the displays that failed.
+		"""
+		return dict((name, device.error) for name, device in self.__devices.items() if device.error is not None)
+
+	def reset(self, name):
+		"""
+		Lets a failed display take part in refresh() again.
+		"""
+		device = self.__devices[name]
+		with device.condition:
+			device.error = None
+
+	def close(self, timeout=5.0):
+		"""
+		Stops all worker threads and closes the displays, waiting at most
+		`timeout` seconds in total for frames still being rendered. Displays
+		that are still busy then are left open.
+		"""
+		devices = list(self.__devices.values())
+		self.__devices.clear()
+		# Tell all threads first so they wind down in parallel
+		for device in devices:
+			device.stop(0)
+
+		deadline = time.monotonic() + timeout
+		for device in devices:
+			if not device.stop(max(0, deadline - time.monotonic())):
+				self.__warnHung(device, timeout)
+				continue
+			if device.serdisp.turnOffOnQuit:
+				device.serdisp.quit()
+			else:
+				device.serdisp.close()
@@ -0,0 +1,343 @@
+# coding: utf-8
+
+"""
+Framebuffer for greyscale and monochrome panels that stores pixels at the
+depth of the display (1, 2, 4 or 8 bits) instead of as 32bit ARGB values.
+Each row is packed into bytes with the leftmost pixel in the most
+significant bits, rows start on a byte boundary. A pixel holds the grey
+level from 0 (black) to 2^depth - 1 (white).
+"""
+
+from framebuffer import BaseFramebuffer, packGrey, WHITE, _B, _G, _R
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+DEPTHS = (1, 2, 4, 8)
+
+# Rows are compared in chunks of this many bytes before looking at single bytes
+_DIFF_CHUNK_BYTES = 16
+
+def _shift(depth, k):
+	"""
+	Bit position of the k-th pixel within a byte.
+	"""
+	return 8 - depth * (k + 1)
+
+# Per depth and pixel position within a byte, translation tables placing a
+# level at that position and extracting it from there.
+_PLACE = {}
+_EXTRACT = {}
+for _depth in DEPTHS:
+	_mask = (1 << _depth) - 1
+	_PLACE[_depth] = [bytes(((v & _mask) << _shift(_depth, k)) & 0xFF for v in range(256)) for k in range(8 // _depth)]
+	_EXTRACT[_depth] = [bytes((v >> _shift(_depth, k)) & _mask for v in range(256)) for k in range(8 // _depth)]
+
+def pack(levels, depth):
+	"""
+	Packs a bytes-like object of levels (one per byte, each below 2^depth)
+	into bytes, padding the last byte with zero bits.
+	"""
+	perByte = 8 // depth
+	if perByte == 1:
+		return bytes(levels)
+
+	levels = bytes(levels)
+	size = (len(levels) + perByte - 1) // perByte
+	levels += bytes(size * perByte - len(levels))
+
+	if numpy is not None:
+		values = numpy.frombuffer(levels, dtype=numpy.uint8).reshape(size, perByte)
+		shifts = numpy.array([_shift(depth, k) for k in range(perByte)], dtype=numpy.uint8)
+		return numpy.bitwise_or.reduce(values << shifts, axis=1).astype(numpy.uint8).tobytes()
+
+	# The levels of each position are moved into place with one translation
+	# and combined with the others as big integers.
+	combined = 0
+	for k in range(perByte):
+		combined |= int.from_bytes(levels[k::perByte].translate(_PLACE[depth][k]), "big")
+	return combined.to_bytes(size, "big")
+
+def unpack(packed, count, depth):
+	"""
+	Returns the first `count` levels of `packed` as bytes, one per level.
+	"""
+	perByte = 8 // depth
+	packed = bytes(packed)
+	if perByte == 1:
+		return packed[:count]
+
+	if numpy is not None:
+		values = numpy.frombuffer(packed, dtype=numpy.uint8)
+		shifts = numpy.array([_shift(depth, k) for k in range(perByte)], dtype=numpy.uint8)
+		levels = (values[:, None] >> shifts) & ((1 << depth) - 1)
+		return levels.astype(numpy.uint8).tobytes()[:count]
+
+	levels = bytearray(len(packed) * perByte)
+	for k in range(perByte):
+		levels[k::perByte] = packed.translate(_EXTRACT[depth][k])
+	return bytes(levels[:count])
+
+class PackedFramebuffer(BaseFramebuffer):
+	"""
+	Drop-in replacement for framebuffer.Framebuffer at the depth of the
+	display, see Serdisp(packed=True). Takes and returns ARGB values like
+	Framebuffer, colours are reduced to grey levels when drawn.
+	"""
+	def __init__(self, width, height, depth):
+		if depth not in DEPTHS:
+			raise ValueError("Packed framebuffers support depths %s, not %i" % (DEPTHS, depth))
+		self.depth = depth
+		self.levels = (1 << depth) - 1
+		self.perByte = 8 // depth
+		self.stride = (width + self.perByte - 1) // self.perByte
+		self.data = bytearray(self.stride * height)
+
+		# grey value -> level and level -> ARGB
+		self.__toLevel = bytes((g * self.levels + 127) // 255 for g in range(256))
+		self.__toGrey = bytes(l * 255 // self.levels for l in range(self.levels + 1)) + bytes(255 - self.levels)
+		self.__argb = [packGrey(g) for g in self.__toGrey[:self.levels + 1]]
+		self.__colourLevels = {}
+
+		BaseFramebuffer.__init__(self, width, height)
+		self.fill(WHITE)
+
+	def level(self, argb):
+		"""
+		Returns the level an ARGB value is drawn with.
+		"""
+		level = self.__colourLevels.get(argb)
+		if level is None:
+			luminance = (((argb >> 16) & 0xFF) * 299 + ((argb >> 8) & 0xFF) * 587 + (argb & 0xFF) * 114) // 1000
+			level = self.__toLevel[luminance]
+			self.__colourLevels[argb] = level
+		return level
+
+	def setPixel(self, pos, argb):
+		x, y = pos
+		if self.clip[0] <= x < self.clip[2] and self.clip[1] <= y < self.clip[3]:
+			index = y * self.stride + x // self.perByte
+			shift = _shift(self.depth, x % self.perByte)
+			self.data[index] = (self.data[index] & ~(self.levels << shift) & 0xFF) | (self.level(argb) << shift)
+
+	def getPixel(self, pos):
+		x, y = pos
+		byte = self.data[y * self.stride + x // self.perByte]
+		return self.__argb[(byte >> _shift(self.depth, x % self.perByte)) & self.levels]
+
+	def fill(self, argb):
+		self.generation += 1
+		pattern = pack(bytes([self.level(argb)]) * self.perByte, self.depth)
+		self.data[:] = pattern * len(self.data)
+
+	def __writeLevels(self, y, x, levels):
+		"""
+		Writes a run of levels into row `y` starting at `x`. Only bytes
+		partially covered by the run are unpacked and merged.
+		"""
+		perByte = self.perByte
+		end = x + len(levels)
+		first = x // perByte
+		last = (end + perByte - 1) // perByte
+		row = y * self.stride
+
+		head = x - first * perByte
+		tail = last * perByte - end
+		if head or tail:
+			current = unpack(self.data[row + first:row + last], (last - first) * perByte, self.depth)
+			levels = current[:head] + bytes(levels) + current[len(current) - tail:]
+		self.data[row + first:row + last] = pack(levels, self.depth)
+
+	def __writeBlock(self, x, y, width, levels):
+		"""
+		Writes rows of `width` levels each, joined into `levels`, to (x, y).
+		Byte aligned blocks are packed in one go.
+		"""
+		height = len(levels) // width
+		if x % self.perByte or width % self.perByte:
+			for dy in range(height):
+				self.__writeLevels(y + dy, x, levels[dy * width:(dy + 1) * width])
+			return
+
+		packed = pack(levels, self.depth)
+		span = width // self.perByte
+		first = x // self.perByte
+		for dy in range(height):
+			row = (y + dy) * self.stride + first
+			self.data[row:row + span] = packed[dy * span:(dy + 1) * span]
+
+	def fillRect(self, x, y, width, height, argb):
+		"""
+		Fills the given rectangle, clipped to the clip rectangle.
+		"""
+		clipped = self.clipped(x, y, width, height)
+		if not clipped:
+			return
+
+		x0, y0, x1, y1 = clipped
+		if x0 % self.perByte == 0 and (x1 - x0) % self.perByte == 0:
+			row = pack(bytes([self.level(argb)]) * (x1 - x0), self.depth)
+			first = x0 // self.perByte
+			for dy in range(y0, y1):
+				start = dy * self.stride + first
+				self.data[start:start + len(row)] = row
+			return
+
+		levels = bytes([self.level(argb)]) * (x1 - x0)
+		for dy in range(y0, y1):
+			self.__writeLevels(dy, x0, levels)
+
+	def blitGrey(self, x, y, width, height, data, stride=None):
+		"""
+		Copies a width * height block of grey levels (one byte per pixel,
+		row by row) to (x, y), clipped to the clip rectangle. Rows in `data`
+		are `stride` bytes apart, `width` by default.
+		"""
+		clipped = self.clipped(x, y, width, height)
+		if not clipped:
+			return
+
+		x0, y0, x1, y1 = clipped
+		data = memoryview(data).cast("B")
+		stride = width if stride is None else stride
+		span = x1 - x0
+		rows = []
+		for dy in range(y0, y1):
+			src = (dy - y) * stride + (x0 - x)
+			rows.append(data[src:src + span])
+		self.__writeBlock(x0, y0, span, b"".join(rows).translate(self.__toLevel))
+
+	def blitArgb(self, x, y, width, height, data, stride=None):
+		"""
+		Like blitGrey(), but takes ARGB values (any buffer of unsigned ints).
+		"""
+		clipped = self.clipped(x, y, width, height)
+		if not clipped:
+			return
+
+		x0, y0, x1, y1 = clipped
+		data = memoryview(data).cast("B").cast("I")
+		stride = width if stride is None else stride
+		span = x1 - x0
+		rows = []
+		for dy in range(y0, y1):
+			src = (dy - y) * stride + (x0 - x)
+			row = data[src:src + span]
+			if numpy is not None:
+				channels = numpy.frombuffer(row, dtype=numpy.uint8).reshape(span, 4).astype(numpy.uint32)
+				luminance = (channels[:, _R] * 299 + channels[:, _G] * 587 + channels[:, _B] * 114) // 1000
+				rows.append(luminance.astype(numpy.uint8).tobytes().translate(self.__toLevel))
+			else:
+				level = self.level
+				rows.append(bytes(level(argb) for argb in row))
+		self.__writeBlock(x0, y0, span, b"".join(rows))
+
+	def toGrey(self):
+		"""
+		Returns all pixels as grey values, one byte per pixel row by row.
+		"""
+		return self.greyRect(0, 0, self.width, self.height)
+
+	def fromGrey(self, grey):
+		"""
+		Replaces all pixels by a width * height block of grey values.
+		"""
+		levels = bytes(grey).translate(self.__toLevel)
+		if self.width % self.perByte == 0:
+			self.data[:] = pack(levels, self.depth)
+			return
+		for y in range(self.height):
+			row = y * self.width
+			self.data[y * self.stride:(y + 1) * self.stride] = pack(levels[row:row + self.width], self.depth)
+
+	def greyRect(self, x, y, width, height):
+		"""
+		Returns a rectangle of pixels as grey values, one byte per pixel.
+		"""
+		perByte = self.perByte
+		first = x // perByte
+		last = (x + width + perByte - 1) // perByte
+		head = x - first * perByte
+		rows = []
+		for dy in range(y, y + height):
+			row = dy * self.stride
+			levels = unpack(self.data[row + first:row + last], (last - first) * perByte, self.depth)
+			rows.append(levels[head:head + width])
+		return b"".join(rows).translate(self.__toGrey)
+
+	def copy(self):
+		other = PackedFramebuffer(self.width, self.height, self.depth)
+		other.data[:] = self.data
+		return other
+
+	def copyFrom(self, other):
+		self.generation += 1
+		self.data[:] = other.data
+
+	def pixelList(self):
+		"""
+		Returns (x, y, argb) tuples for all pixels.
+		"""
+		argb = self.__argb
+		width = self.width
+		levels = self.toGrey().translate(self.__toLevel)
+		return [(i % width, i // width, argb[level]) for i, level in enumerate(levels)]
+
+	def diff(self, other):
+		"""
+		Returns a list of (x, y, argb) tuples for all pixels that differ
+		from the equally sized and deep framebuffer `other`, argb being our
+		value. Works on the packed bytes, only bytes that differ are looked
+		at pixel by pixel.
+		"""
+		depth = self.depth
+		perByte = self.perByte
+		width = self.width
+		argb = self.__argb
+
+		if self.data == other.data:
+			return []
+
+		if numpy is not None:
+			mine = numpy.frombuffer(self.data, dtype=numpy.uint8)
+			theirs = numpy.frombuffer(other.data, dtype=numpy.uint8)
+			indices = numpy.flatnonzero(mine != theirs)
+			# Pixels within the changed bytes whose bits differ
+			shifts = numpy.array([_shift(depth, k) for k in range(perByte)], dtype=numpy.uint8)
+			differing = ((mine[indices] ^ theirs[indices])[:, None] >> shifts) & self.levels
+			changedBytes, positions = numpy.nonzero(differing)
+			indices = indices[changedBytes]
+			ys, xs = numpy.divmod(indices, self.stride)
+			xs = xs * perByte + positions
+			levels = (mine[indices] >> shifts[positions]) & self.levels
+			inside = xs < width
+			return [(x, y, argb[level]) for x, y, level in
+				zip(xs[inside].tolist(), ys[inside].tolist(), levels[inside].tolist())]
+
+		changed = []
+		mine = self.data
+		theirs = other.data
+		stride = self.stride
+		mask = self.levels
+		for y in range(self.height):
+			row = y * stride
+			if mine[row:row + stride] == theirs[row:row + stride]:
+				continue
+
+			for chunk in range(row, row + stride, _DIFF_CHUNK_BYTES):
+				end = min(chunk + _DIFF_CHUNK_BYTES, row + stride)
+				if mine[chunk:end] == theirs[chunk:end]:
+					continue
+				for i in range(chunk, end):
+					if mine[i] == theirs[i]:
+						continue
+					for k in range(perByte):
+						x = (i - row) * perByte + k
+						shift = _shift(depth, k)
+						level = (mine[i] >> shift) & mask
+						if x < width and level != (theirs[i] >> shift) & mask:
+							changed.append((x, y, argb[level]))
+
+		return changed
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+"""
+Drawing primitives on a Framebuffer. Colours are ARGB values or colour
+tuples (see framebuffer.packColour), everything is clipped to the
+framebuffer's clip rectangle and works on whole rows or columns at once.
+"""
+
+from array import array
+
+from framebuffer import Framebuffer, packColour, WHITE
+
+def fillRect(framebuffer, x, y, width, height, colour):
+	framebuffer.fillRect(x, y, width, height, packColour(colour))
+
+def clearRegion(framebuffer, x, y, width, height, background=WHITE):
+	"""
+	Resets a rectangle to `background`, white by default.
+	"""
+	framebuffer.fillRect(x, y, width, height, packColour(background))
+
+def hline(framebuffer, x, y, length, colour):
+	"""
+	Draws a horizontal line from (x, y) to the right.
+	"""
+	framebuffer.fillRect(x, y, length, 1, packColour(colour))
+
+def vline(framebuffer, x, y, length, colour):
+	"""
+	Draws a vertical line from (x, y) downwards with a single strided
+	assignment.
+	"""
+	if not isinstance(framebuffer, Framebuffer):
+		# Packed framebuffers have no pixel array to stride through
+		framebuffer.fillRect(x, y, 1, length, packColour(colour))
+		return
+
+	clipped = framebuffer.clipped(x, y, 1, length)
+	if not clipped:
+		return
+
+	x0, y0, x1, y1 = clipped
+	width = framebuffer.width
+	framebuffer.pixels[y0 * width + x0:(y1 - 1) * width + x0 + 1:width] = array("I", [packColour(colour)]) * (y1 - y0)
+
+def rect(framebuffer, x, y, width, height, colour):
+	"""
+	Draws the outline of a rectangle, 1 pixel wide.
+	"""
+	if width <= 0 or height <= 0:
+		return
+
+	argb = packColour(colour)
+	hline(framebuffer, x, y, width, argb)
+	if height > 1:
+		hline(framebuffer, x, y + height - 1, width, argb)
+	if height > 2:
+		vline(framebuffer, x, y + 1, height - 2, argb)
+		if width > 1:
+			vline(framebuffer, x + width - 1, y + 1, height - 2, argb)
+
+def blit(framebuffer, x, y, source, sourceX=0, sourceY=0, width=None, height=None):
+	"""
+	Copies a rectangle of the framebuffer `source` (all of it by default)
+	to (x, y). Packed sources are copied as grey values.
+	"""
+	if width is None:
+		width = source.width - sourceX
+	if height is None:
+		height = source.height - sourceY
+
+	# Keep the source rectangle within the source
+	if sourceX < 0:
+		x -= sourceX
+		width += sourceX
+		sourceX = 0
+	if sourceY < 0:
+		y -= sourceY
+		height += sourceY
+		sourceY = 0
+	width = min(width, source.width - sourceX)
+	height = min(height, source.height - sourceY)
+	if width <= 0 or height <= 0:
+		return
+
+	if not isinstance(source, Framebuffer):
+		framebuffer.blitGrey(x, y, width, height, source.greyRect(sourceX, sourceY, width, height))
+		return
+
+	# Rows are copied top to bottom, which would overwrite rows still to be
+	# copied when moving an area within the same framebuffer downwards
+	if source is framebuffer:
+		source = source.copy()
+
+	offset = sourceY * source.width + sourceX
+	framebuffer.blitArgb(x, y, width, height, source.pixels[offset:], stride=source.width)
@@ -4,16 +4,104 @@
 # - Try to fetch an error message from serdisplib upon failure to init the disp
 
 import ctypes
-from ctypes import c_int, c_long, c_ubyte
+from collections import namedtuple
+from ctypes import byref, c_char_p, c_int, c_long, c_ubyte, c_void_p, pointer, POINTER, Structure
+from types import SimpleNamespace
+from colourtable import ColourTable
+from framebuffer import Framebuffer, packColour, WHITE
+from packedframebuffer import PackedFramebuffer, DEPTHS as PACKED_DEPTHS
+from instrumentation import Instrumentation
+from recorder import Recorder
+from sharedframe import SharedFramebuffer
+
+# serdisplib entry points as (name, restype, argtypes). They are resolved and
+# prototyped once in Serdisp.init() and then available as Serdisp.fn.<name>
+# without the "serdisp_" prefix.
+_PROTOTYPES = (
+	("SDCONN_open",			c_void_p,	[c_char_p]),
+	("serdisp_init",		c_void_p,	[c_void_p, c_char_p, c_char_p]),
+	("serdisp_close",		None,		[c_void_p]),
+	("serdisp_quit",		None,		[c_void_p]),
+	("serdisp_reset",		c_int,		[c_void_p]),
+	("serdisp_fullreset",		c_void_p,	[c_void_p]),
+	("serdisp_setpixel",		None,		[c_void_p, c_int, c_int, c_long]),
+	("serdisp_getpixel",		c_long,		[c_void_p, c_int, c_int]),
+	("serdisp_clear",		None,		[c_void_p]),
+	("serdisp_clearbuffer",		None,		[c_void_p]),
+	("serdisp_update",		None,		[c_void_p]),
+	("serdisp_rewrite",		None,		[c_void_p]),
+	("serdisp_blink",		None,		[c_void_p, c_int, c_int, c_int]),
+	("serdisp_getwidth",		c_int,		[c_void_p]),
+	("serdisp_getheight",		c_int,		[c_void_p]),
+	("serdisp_getcolours",		c_int,		[c_void_p]),
+	("serdisp_getdepth",		c_int,		[c_void_p]),
+	("serdisp_getpixelaspect",	c_int,		[c_void_p]),
+	("serdisp_getoption",		c_long,		[c_void_p, c_char_p, POINTER(c_int)]),
+	("serdisp_setoption",		None,		[c_void_p, c_char_p, c_long]),
+	("serdisp_isoption",		c_int,		[c_void_p, c_char_p]),
+	("serdisp_nextoptiondescription", c_int,	[c_void_p, c_void_p]),
+	("serdisp_getcolour",		c_long,		[c_void_p, c_int, c_int]),
+	("serdisp_setcolour",		None,		[c_void_p, c_int, c_int, c_long]),
+	("serdisp_getgrey",		c_ubyte,	[c_void_p, c_int, c_int]),
+	("serdisp_setgrey",		None,		[c_void_p, c_int, c_int, c_ubyte]),
+	("serdisp_transcolour",		c_long,		[c_void_p, c_long]),
+	("serdisp_transgrey",		c_long,		[c_void_p, c_ubyte]),
+	("serdisp_lookupcolour",	c_long,		[c_void_p, c_long]),
+	("serdisp_lookupgrey",		c_ubyte,	[c_void_p, c_long]),
+	("serdisp_isdisplay",		c_int,		[c_void_p]),
+)
+
+class _OptionDescription(Structure):
+	# serdisp_options_t
+	_fields_ = [
+		("name", c_char_p),
+		("aliasnames", c_char_p),
+		("minval", c_long),
+		("maxval", c_long),
+		("modulo", c_long),
+		("flag", c_ubyte),
+		("defines", c_char_p),
+	]
+
+# Immutable snapshot of what the display can do, taken once in Serdisp.init()
+Capabilities = namedtuple("Capabilities", "width height depth colours pixelAspect options")
+Option = namedtuple("Option", "name aliasnames minval maxval modulo flag defines")
+
+def _decode(value):
+	return value.decode() if value is not None else None
+
+def _missing(name):
+	def call(*args):
+		raise AttributeError("serdisplib doesn't provide %s" % name)
+	return call
 
 class Serdisp:
-	def __init__(self, device, model, options = ""):
+	def __init__(self, device, model, options = "", backend = None, packed = False):
+		"""
+		`backend` replaces libserdisp.so, ex. with a virtualdisplay.VirtualDisplay.
+		It has to provide the serdisplib functions under their C names.
+		`packed` keeps the framebuffer at the depth of the display instead of
+		ARGB, see packedframebuffer.py. Only for displays of depth 1, 2, 4 and 8.
+		"""
 		self.device = device
 		self.model = model
 		self.options = options
 		self.turnOffOnQuit = True
-		self.sdl = ctypes.CDLL("libserdisp.so")
+		self.__colourTable = None
+		self.__instrumentation = None
+		self.__recorder = None
+		self.__shared = None
+		self.sdl = backend if backend is not None else ctypes.CDLL("libserdisp.so")
 		self.init()
+		# Widgets draw in here, flush() pushes it to the device
+		if packed and self.getDepth() in PACKED_DEPTHS:
+			self.framebuffer = PackedFramebuffer(self.getWidth(), self.getHeight(), self.getDepth())
+		else:
+			if packed:
+				print("Warning: no packed framebuffer for depth %i, using ARGB" % self.getDepth())
+			self.framebuffer = Framebuffer(self.getWidth(), self.getHeight())
+		# What the display shows according to the last flush()
+		self.shadow = self.framebuffer.copy()
 		self.clear() # display might be full of randomness if we don't clear here
 
 	def __enter__(self):
@@ -27,30 +115,17 @@ class Serdisp:
 
 	# constructs a single 32bit integer from a tuple (a, r, g, b)
 	def __pack(self, rgbTuple):
-		argb = ()
-
 		try:
-			if len(rgbTuple) == 4:
-				argb = (rgbTuple[0] << 8) + rgbTuple[1]
-				argb = (argb << 8) + rgbTuple[2]
-				argb = (argb << 8) + rgbTuple[3]
-			elif len(rgbTuple) == 3:
-				# Assuming alpha as fully opaque
-				argb = (0xFF << 8) + rgbTuple[0]
-				argb = (argb << 8) + rgbTuple[1]
-				argb = (argb << 8) + rgbTuple[2]
+			return packColour(rgbTuple)
 		except Exception:
 			raise Exception("Colour tuples should be [ARGB], [RGB] formatted. Is:", rgbTuple)
 
-		return c_long(argb)
-
 	# extracts separate argb values from a 32bit integer
 	def __unpack(self, argb):
-		rgbTuple = ()
-		rgbTuple[0] = (argb & 0xff000000) >> 24
-		rgbTuple[1] = (argb & 0x00ff0000) >> 16
-		rgbTuple[2] = (argb & 0x0000ff00) >> 8
-		rgbTuple[3] =  argb & 0x000000ff
+		return ((argb & 0xff000000) >> 24,
+			(argb & 0x00ff0000) >> 16,
+			(argb & 0x0000ff00) >> 8,
+			argb & 0x000000ff)
 
 	def setTurnOffOnQuit(self, turnOffOnQuit):
 		self.turnOffOnQuit = turnOffOnQuit
@@ -62,45 +137,206 @@ class Serdisp:
 	OPTION_YES = 1
 	OPTION_TOGGLE = 2
 
+	def __bind(self):
+		"""
+		Resolves and prototypes the serdisplib functions once so that calls
+		don't pay for attribute lookups and argument guessing.
+		"""
+		fn = {}
+		isCLibrary = isinstance(self.sdl, ctypes.CDLL)
+		for name, restype, argtypes in _PROTOTYPES:
+			func = getattr(self.sdl, name, None)
+			if func is None:
+				func = _missing(name)
+			elif isCLibrary:
+				func.restype = restype
+				func.argtypes = argtypes
+			fn[name.replace("serdisp_", "")] = func
+		self.__functions = fn
+		self.__installFunctions()
+
+	def __installFunctions(self):
+		fn = self.__functions
+		if self.__recorder is not None:
+			fn = self.__recorder.wrap(fn)
+		if self.__instrumentation is not None:
+			fn = self.__instrumentation.wrap(fn)
+		self.fn = SimpleNamespace(**fn)
+
+	def __queryCapabilities(self):
+		options = []
+		desc = _OptionDescription()
+		desc.name = b""
+		while self.fn.nextoptiondescription(self.disp, pointer(desc)):
+			options.append(Option(_decode(desc.name), _decode(desc.aliasnames),
+				desc.minval, desc.maxval, desc.modulo, desc.flag, _decode(desc.defines)))
+
+		fn = self.fn
+		return Capabilities(fn.getwidth(self.disp), fn.getheight(self.disp),
+			fn.getdepth(self.disp), fn.getcolours(self.disp),
+			fn.getpixelaspect(self.disp), tuple(options))
+
 	# TODO move SDCONN_open and serdisp_init here (as one)
 	def init(self):
-		self.conn = self.sdl.SDCONN_open(self.device)
-		if self.conn == 0:
+		self.__bind()
+		self.conn = self.fn.SDCONN_open(self.device.encode())
+		if not self.conn:
 			raise Exception("Couldn't open display. Device: \"%s\" Model: \"%s\"" % (self.device, self.model))
 
-		self.disp = self.sdl.serdisp_init(self.conn, self.model, self.options)
-		if self.disp == 0:
+		self.disp = self.fn.init(self.conn, self.model.encode(), self.options.encode())
+		if not self.disp:
 			raise Exception("Couldn't initialize the display!")
 
+		self.capabilities = self.__queryCapabilities()
+
 	def close(self):
-		self.sdl.serdisp_close(self.disp)
+		self.stopRecording()
+		self.fn.close(self.disp)
 
 	def quit(self):
-		self.sdl.serdisp_quit(self.disp)
+		self.stopRecording()
+		self.fn.quit(self.disp)
 
 	def reset(self):
-		self.sdl.serdisp_reset(self.disp)
+		self.fn.reset(self.disp)
 
 	def fullReset(self):
-		self.sdl.serdisp_fullreset(self.disp)
+		# serdisplib hands out a new display descriptor here
+		disp = self.fn.fullreset(self.disp)
+		if not disp:
+			raise Exception("Couldn't reinitialize the display!")
+		self.disp = disp
 
 	def setPixel(self, pos, colour):
-		self.sdl.serdisp_setpixel(self.disp, c_int(pos[0]), c_int(pos[1]), c_int(colour))
+		self.fn.setpixel(self.disp, pos[0], pos[1], colour)
 
 	def getPixel(self, pos):
-		return self.sdl.serdisp_setpixel(self.disp, c_int(pos[0]), c_int(pos[1]))
+		return self.fn.getpixel(self.disp, pos[0], pos[1])
 
 	def clear(self):
-		self.sdl.serdisp_clear(self.disp)
+		self.fn.clear(self.disp)
+		self.framebuffer.fill(WHITE)
+		self.shadow.fill(WHITE)
 
 	def clearBuffer(self):
-		self.sdl.serdisp_clearbuffer(self.disp)
+		self.fn.clearbuffer(self.disp)
 
 	def update(self):
-		self.sdl.serdisp_update(self.disp)
+		self.fn.update(self.disp)
 
 	def rewrite(self):
-		self.sdl.serdisp_rewrite(self.disp)
+		self.fn.rewrite(self.disp)
+
+	def flush(self, full=False, framebuffer=None):
+		"""
+		Writes the pixels that changed since the last flush from the
+		framebuffer to the display and updates it. Pass full=True to write
+		every pixel, ex. after drawing with setColour()/setGrey() directly.
+		`framebuffer` flushes another equally sized framebuffer instead of
+		our own one. Returns the number of pixels sent.
+		"""
+		if self.__shared is not None and framebuffer is None:
+			return self.__shared.flush(self, full)
+
+		setcolour = self.fn.setcolour
+		disp = self.disp
+		if framebuffer is None:
+			framebuffer = self.framebuffer
+
+		if full:
+			changed = framebuffer.pixelList()
+		else:
+			changed = framebuffer.diff(self.shadow)
+
+		for x, y, argb in changed:
+			setcolour(disp, x, y, argb)
+
+		self.shadow.copyFrom(framebuffer)
+		self.update()
+		return len(changed)
+
+	def shareFramebuffer(self, path):
+		"""
+		Moves the framebuffer into the file `path` (preferably on a tmpfs like
+		/dev/shm), so other processes can map it and draw into it directly,
+		see sharedframe.py. flush() sends straight from that memory.
+		Returns the sharedframe.SharedFramebuffer.
+		"""
+		if not isinstance(self.framebuffer, Framebuffer):
+			raise ValueError("Only ARGB framebuffers can be shared, not packed ones")
+		shared = SharedFramebuffer.create(path, self.getWidth(), self.getHeight())
+		shared.framebuffer.copyFrom(self.framebuffer)
+		self.framebuffer = shared.framebuffer
+		self.__shared = shared
+		shared.onClose = self.__sharedClosing
+		return shared
+
+	def unshareFramebuffer(self, unlink=True):
+		"""
+		Stops sharing the framebuffer: its contents move back into a private
+		one and the shared file is unmapped and, unless `unlink` is False,
+		removed. Closing the SharedFramebuffer directly does the same except
+		for removing the file.
+		"""
+		shared = self.__shared
+		if shared is None:
+			return
+		shared.close()
+		if unlink:
+			shared.unlink()
+
+	def __sharedClosing(self, shared):
+		if shared is not self.__shared:
+			return
+		framebuffer = Framebuffer(self.getWidth(), self.getHeight())
+		framebuffer.copyFrom(shared.framebuffer)
+		self.framebuffer = framebuffer
+		self.__shared = None
+
+	def enableInstrumentation(self, hook=None):
+		"""
+		Starts counting the calls into serdisplib, timing update(), rewrite()
+		and clear() and counting the pixels written per frame, see stats().
+		`hook` is called as hook(name, seconds, pixels) after each timed
+		call, ex. to feed a metrics exporter.
+		"""
+		self.__instrumentation = Instrumentation(hook)
+		self.__installFunctions()
+
+	def disableInstrumentation(self):
+		self.__instrumentation = None
+		self.__installFunctions()
+
+	def stats(self):
+		"""
+		Returns an instrumentation.Stats snapshot or None if instrumentation is off.
+		"""
+		if self.__instrumentation is None:
+			return None
+		return self.__instrumentation.snapshot()
+
+	def resetStats(self):
+		if self.__instrumentation is not None:
+			self.__instrumentation.reset()
+
+	def startRecording(self, path):
+		"""
+		Records all drawing calls into serdisplib (setColour, setGrey, clear,
+		update, the pixels sent by flush(), ...) with timestamps to the file
+		`path` until stopRecording() is called. Play it back with
+		recorder.Replayer. Returns the recorder.Recorder.
+		"""
+		self.stopRecording()
+		self.__recorder = Recorder(path, self.getWidth(), self.getHeight(), self.getDepth())
+		self.__installFunctions()
+		return self.__recorder
+
+	def stopRecording(self):
+		if self.__recorder is not None:
+			recorder = self.__recorder
+			self.__recorder = None
+			self.__installFunctions()
+			recorder.close()
 
 	def blink(self, what, count, delta):
 		if count < 0:
@@ -113,38 +349,43 @@ class Serdisp:
 		elif what == "pixels":
 			what = 1
 
-		self.sdl.serdisp_blink(self.disp, what, c_int(count), c_int(delta))
+		self.fn.blink(self.disp, what, count, delta)
+
+	# Display properties don't change, these come from the snapshot taken in init()
 
 	def getWidth(self):
-		return self.sdl.serdisp_getwidth(self.disp)
+		return self.capabilities.width
 
 	def getHeight(self):
-		return self.sdl.serdisp_getheight(self.disp)
+		return self.capabilities.height
 
 	def getColours(self):
-		return self.sdl.serdisp_getcolours(self.disp)
+		return self.capabilities.colours
 
 	def getDepth(self):
-		return self.sdl.serdisp_getdepth(self.disp)
+		return self.capabilities.depth
 
 	def getPixelAspect(self):
-		return self.sdl.serdisp_getpixelaspect(self.disp)
+		return self.capabilities.pixelAspect
+
+	def getOptions(self):
+		return self.capabilities.options
 
 	def getDisplayName(self):
 		return self.model # serdisplib does the same anyway
 
 	def isDisplay(self):
-		return bool(self.sdl.serdisp_isdisplay(self.disp))
+		return bool(self.fn.isdisplay(self.disp))
 
 	def getOption(self, option):
-		output = -1
-		return self.sdl.serdisp_getoption(self.disp, option, output)
+		typesize = c_int(-1)
+		return self.fn.getoption(self.disp, option.encode(), byref(typesize))
 
 	def setOption(self, option, value):
-		self.sdl.serdisp_setoption(self.disp, option, value)
+		self.fn.setoption(self.disp, option.encode(), value)
 
 	def isOption(self, option):
-		return self.sdl.serdisp_isoption(self.disp, option)
+		return self.fn.isoption(self.disp, option.encode())
 
 	# TODO display description functions
 
@@ -159,32 +400,44 @@ class Serdisp:
 	BLUE	= (255, 0, 0, 255)
 
 	def getColour(self, pos):
-		col = self.sdl.serdisp_getcolour(self.disp, c_int(pos[0]), c_int(pos[1]))
+		col = self.fn.getcolour(self.disp, pos[0], pos[1])
 		return self.__unpack(col)
 
 	def getGrey(self, pos):
-		return self.sdl.serdisp_getgrey(self.disp, c_int(pos[0]), c_int(pos[1]))
+		return self.fn.getgrey(self.disp, pos[0], pos[1])
 
 	def setColour(self, pos, color):
-		self.sdl.serdisp_setcolour(self.disp, c_int(pos[0]), c_int(pos[1]), self.__pack(color))
+		self.fn.setcolour(self.disp, pos[0], pos[1], self.__pack(color))
 
 	def setGrey(self, pos, grey):
 		if grey < 0 or grey > 255:
 			raise Exception("Grey value must be within [0, 255]")
 
-		self.sdl.serdisp_setgrey(self.disp, c_int(pos[0]), c_int(pos[1]), c_ubyte(grey))
+		self.fn.setgrey(self.disp, pos[0], pos[1], grey)
+
+	def colourTable(self):
+		"""
+		Returns the ColourTable of this display, it is built on first use.
+		Use it to translate whole arrays of colours at once.
+		"""
+		if self.__colourTable is None:
+			self.__colourTable = ColourTable(self)
+		return self.__colourTable
+
+	# The translations below are answered from the colour table instead of
+	# calling into serdisplib every time.
 
 	def transColour(self, argbColour):
-		return self.sdl.serdisp_transcolour(self.disp, c_long(argbColour))
+		return self.colourTable().transColour(packColour(argbColour))
 
 	def transGrey(self, grey):
-		return self.sdl.serdisp_transgrey(self.disp, c_ubyte(grey))
+		return self.colourTable().grey[grey]
 
 	def lookupColour(self, argbColour):
-		return self.sdl.serdisp_lookupcolor(self.disp, c_long(argbColour))
+		return self.colourTable().lookupColour(argbColour)
 
 	def lookupGrey(self, grey):
-		return self.sdl.serdisp_lookupgrey(self.disp, c_long(grey))
+		return self.colourTable().lookupColour(grey) & 0xFF
 
 	# serdisp_messages.h
 	# ==================
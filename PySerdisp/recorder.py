@@ -0,0 +1,247 @@
+# coding: utf-8
+
+"""
+Records the drawing calls a Serdisp makes into serdisplib to a compact
+binary log and replays such logs into any display, ex. a VirtualDisplay,
+as fast as possible or in real time.
+
+Log layout: a header (magic, width, height, depth), then records of a
+timestamp in seconds since the start of the recording and an opcode,
+followed by the opcode's arguments. Consecutive setcolour calls along a
+row, as flush() makes them, are stored as one span of ARGB values.
+"""
+
+import struct
+import sys
+import time
+from array import array
+
+from framebuffer import packGrey, WHITE
+
+_HEADER = struct.Struct("<4sIIB3x")
+_MAGIC = b"SDR2"
+_RECORD = struct.Struct("<dB")
+# Coordinates are signed, off-screen writes are recorded like serdisplib gets them
+_SPAN = struct.Struct("<iiH")
+_GREY = struct.Struct("<iiB")
+_PIXEL = struct.Struct("<iiI")
+
+SPAN = 1
+SETGREY = 2
+SETPIXEL = 3
+CLEAR = 4
+CLEARBUFFER = 5
+UPDATE = 6
+REWRITE = 7
+
+# Most pixels a span record holds
+_MAX_SPAN = 0xFFFF
+
+# Coordinates have to fit a C int for serdisplib, anything else isn't recorded
+_INT_MIN = -(1 << 31)
+_INT_MAX = (1 << 31) - 1
+
+def _isInt(value):
+	return _INT_MIN <= value <= _INT_MAX
+
+def _littleEndian(values):
+	if sys.byteorder != "little":
+		values.byteswap()
+	return values
+
+class Recorder:
+	"""
+	Writes the calls going through Serdisp.fn to a log file, see
+	Serdisp.startRecording(). Calls that don't draw (queries, options and
+	the like) are not recorded.
+	"""
+	def __init__(self, path, width, height, depth):
+		self.path = path
+		self.records = 0
+		self.__file = open(path, "wb")
+		self.__file.write(_HEADER.pack(_MAGIC, width, height, depth))
+		self.__start = time.monotonic()
+		self.__spanTime = 0.0
+		self.__spanX = 0
+		self.__spanY = 0
+		self.__span = None
+
+	def wrap(self, functions):
+		"""
+		Returns a copy of the {name: function} dict `functions` with the drawing
+		functions replaced by recording ones.
+		"""
+		wrapped = dict(functions)
+		wrapped["setcolour"] = self.__setColour(functions["setcolour"])
+		wrapped["setgrey"] = self.__withArgs(functions["setgrey"], SETGREY, _GREY, 0xFF)
+		wrapped["setpixel"] = self.__withArgs(functions["setpixel"], SETPIXEL, _PIXEL, 0xFFFFFFFF)
+		for name, opcode in (("clear", CLEAR), ("clearbuffer", CLEARBUFFER), ("update", UPDATE), ("rewrite", REWRITE)):
+			wrapped[name] = self.__withoutArgs(functions[name], opcode)
+		return wrapped
+
+	def __now(self):
+		return time.monotonic() - self.__start
+
+	def __write(self, timestamp, opcode, payload=b""):
+		self.__file.write(_RECORD.pack(timestamp, opcode) + payload)
+		self.records += 1
+
+	def __endSpan(self):
+		if self.__span:
+			span = self.__span
+			self.__span = None
+			self.__write(self.__spanTime, SPAN, _SPAN.pack(self.__spanX, self.__spanY, len(span)) +
+				_littleEndian(array("I", span)).tobytes())
+
+	def __setColour(self, func):
+		def call(disp, x, y, argb):
+			span = self.__span
+			if not (_isInt(x) and _isInt(y)):
+				self.__endSpan()
+			elif span is not None and y == self.__spanY and x == self.__spanX + len(span) and len(span) < _MAX_SPAN:
+				span.append(argb & 0xFFFFFFFF)
+			else:
+				self.__endSpan()
+				self.__spanTime = self.__now()
+				self.__spanX = x
+				self.__spanY = y
+				self.__span = [argb & 0xFFFFFFFF]
+			return func(disp, x, y, argb)
+		return call
+
+	def __withArgs(self, func, opcode, args, mask):
+		def call(disp, x, y, value):
+			self.__endSpan()
+			if _isInt(x) and _isInt(y):
+				self.__write(self.__now(), opcode, args.pack(x, y, value & mask))
+			return func(disp, x, y, value)
+		return call
+
+	def __withoutArgs(self, func, opcode):
+		def call(disp):
+			self.__endSpan()
+			self.__write(self.__now(), opcode)
+			return func(disp)
+		return call
+
+	def close(self):
+		self.__endSpan()
+		self.__file.close()
+
+def readLog(path):
+	"""
+	Returns ((width, height, depth), records) of a log, records being a list
+	of (timestamp, opcode, args) tuples. Spans have (x, y, argbValues) as args.
+	"""
+	with open(path, "rb") as f:
+		data = f.read()
+
+	magic, width, height, depth = _HEADER.unpack_from(data)
+	if magic != _MAGIC:
+		raise ValueError("Not a serdisp recording: %s" % path)
+
+	records = []
+	offset = _HEADER.size
+	while offset < len(data):
+		timestamp, opcode = _RECORD.unpack_from(data, offset)
+		offset += _RECORD.size
+		if opcode == SPAN:
+			x, y, count = _SPAN.unpack_from(data, offset)
+			offset += _SPAN.size
+			values = array("I")
+			values.frombytes(data[offset:offset + count * 4])
+			offset += count * 4
+			args = (x, y, _littleEndian(values))
+		elif opcode == SETGREY:
+			args = _GREY.unpack_from(data, offset)
+			offset += _GREY.size
+		elif opcode == SETPIXEL:
+			args = _PIXEL.unpack_from(data, offset)
+			offset += _PIXEL.size
+		elif opcode in (CLEAR, CLEARBUFFER, UPDATE, REWRITE):
+			args = ()
+		else:
+			raise ValueError("Unknown opcode %i at offset %i in %s" % (opcode, offset, path))
+		records.append((timestamp, opcode, args))
+
+	return (width, height, depth), records
+
+class Replayer:
+	"""
+	Plays a recording back into a Serdisp:
+
+		replayer = Replayer("dashboard.sdr")
+		virtual = VirtualDisplay(*replayer.geometry)
+		replayer.replay(Serdisp("VIRTUAL", "VIRTUAL", backend=virtual))
+
+	By default the recorded calls are made as they are. With viaFramebuffer=True
+	they are drawn into the framebuffer instead and every update or rewrite
+	becomes a flush(), which is what the flush strategy of the Serdisp
+	decides on.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.geometry, self.records = readLog(path)
+		self.frames = sum(1 for record in self.records if record[1] in (UPDATE, REWRITE))
+
+	def duration(self):
+		return self.records[-1][0] if self.records else 0.0
+
+	def replay(self, serdisp, realtime=False, speed=1.0, viaFramebuffer=False):
+		"""
+		Replays all records, in real time (scaled by `speed`) if `realtime`
+		is set. Returns the seconds it took.
+		"""
+		if (serdisp.getWidth(), serdisp.getHeight()) != self.geometry[:2]:
+			print("Warning: replaying a %ix%i recording on a %ix%i display" % (self.geometry[0],
+				self.geometry[1], serdisp.getWidth(), serdisp.getHeight()))
+
+		play = self.__drawFramebuffer if viaFramebuffer else self.__call
+		fn = serdisp.fn
+		start = time.monotonic()
+		for timestamp, opcode, args in self.records:
+			if realtime:
+				delay = start + timestamp / speed - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+			play(serdisp, fn, opcode, args)
+		return time.monotonic() - start
+
+	def __call(self, serdisp, fn, opcode, args):
+		disp = serdisp.disp
+		if opcode == SPAN:
+			x, y, values = args
+			setcolour = fn.setcolour
+			for argb in values:
+				setcolour(disp, x, y, argb)
+				x += 1
+		elif opcode == SETGREY:
+			fn.setgrey(disp, *args)
+		elif opcode == SETPIXEL:
+			fn.setpixel(disp, *args)
+		elif opcode == CLEAR:
+			fn.clear(disp)
+		elif opcode == CLEARBUFFER:
+			fn.clearbuffer(disp)
+		elif opcode == UPDATE:
+			fn.update(disp)
+		elif opcode == REWRITE:
+			fn.rewrite(disp)
+
+	def __drawFramebuffer(self, serdisp, fn, opcode, args):
+		framebuffer = serdisp.framebuffer
+		if opcode == SPAN:
+			x, y, values = args
+			framebuffer.blitArgb(x, y, len(values), 1, values)
+		elif opcode == SETGREY:
+			framebuffer.setPixel(args[:2], packGrey(args[2]))
+		elif opcode == SETPIXEL:
+			framebuffer.setPixel(args[:2], serdisp.colourTable().lookupColour(args[2]))
+		elif opcode == CLEAR:
+			serdisp.clear()
+		elif opcode == CLEARBUFFER:
+			framebuffer.fill(WHITE)
+		elif opcode == UPDATE:
+			serdisp.flush()
+		elif opcode == REWRITE:
+			serdisp.flush(full=True)
@@ -0,0 +1,149 @@
+# coding: utf-8
+
+import time
+from framebuffer import WHITE
+
+def _intersect(a, b):
+	"""
+	Returns the intersection of two (x, y, width, height) rectangles or None.
+	"""
+	x0 = max(a[0], b[0])
+	y0 = max(a[1], b[1])
+	x1 = min(a[0] + a[2], b[0] + b[2])
+	y1 = min(a[1] + a[3], b[1] + b[3])
+	if x0 >= x1 or y0 >= y1:
+		return None
+	return (x0, y0, x1 - x0, y1 - y0)
+
+def _union(a, b):
+	x0 = min(a[0], b[0])
+	y0 = min(a[1], b[1])
+	x1 = max(a[0] + a[2], b[0] + b[2])
+	y1 = max(a[1] + a[3], b[1] + b[3])
+	return (x0, y0, x1 - x0, y1 - y0)
+
+class Scene:
+	"""
+	Holds widgets and repaints only what changed. Widgets report changes
+	(setText(), setState(), a new Text slice, ...) through invalidate(),
+	render() then clears the damaged areas, redraws the widgets overlapping
+	them in z-order and flushes the display once.
+
+		scene = Scene(serdisp)
+		scene.add(Pixmap(serdisp, "logo.png", (0, 0)))
+		clock = scene.add(Text(serdisp, (2, 2), font, 24, "12:00"), z=1)
+		while True:
+			clock.setText(time.strftime("%H:%M"))
+			scene.render()
+			time.sleep(1)
+	"""
+	def __init__(self, serdisp, background=WHITE):
+		self.serdisp = serdisp
+		self.background = background
+		self.widgets = []
+		self.__order = 0
+		# Area each widget covered when it was drawn last
+		self.__drawnBounds = {}
+		self.__damage = []
+		# Called without arguments whenever damage comes in, see FrameScheduler
+		self.onInvalidate = None
+
+	def add(self, widget, z=0):
+		"""
+		Adds a widget, higher z values are drawn on top. Returns the widget.
+		"""
+		self.__order += 1
+		self.widgets.append((z, self.__order, widget))
+		self.widgets.sort(key=lambda entry: entry[:2])
+		widget.scene = self
+		self.invalidate(widget)
+		return widget
+
+	def remove(self, widget):
+		self.widgets = [entry for entry in self.widgets if entry[2] is not widget]
+		widget.scene = None
+		self.damage(self.__drawnBounds.pop(widget, widget.bounds()))
+
+	def invalidate(self, widget, rect=None):
+		"""
+		Marks the area a widget covered when it was drawn last and the area
+		it covers now as damaged. Widgets that know what changed can pass
+		the `rect` to repaint instead.
+		"""
+		if rect is not None:
+			self.damage(rect)
+			return
+		if widget in self.__drawnBounds:
+			self.damage(self.__drawnBounds[widget])
+		self.damage(widget.bounds())
+
+	def damage(self, rect):
+		"""
+		Marks a (x, y, width, height) rectangle as in need of repainting.
+		"""
+		if rect[2] <= 0 or rect[3] <= 0:
+			return
+
+		# Overlapping damage is merged so nothing gets painted twice
+		merged = True
+		while merged:
+			merged = False
+			for other in self.__damage:
+				if _intersect(rect, other):
+					self.__damage.remove(other)
+					rect = _union(rect, other)
+					merged = True
+					break
+		self.__damage.append(rect)
+
+		if self.onInvalidate is not None:
+			self.onInvalidate()
+
+	def isDirty(self):
+		return len(self.__damage) > 0
+
+	def advance(self, now=None):
+		"""
+		Lets all widgets update their time-based state.
+		"""
+		if now is None:
+			now = time.time()
+		for z, order, widget in self.widgets:
+			widget.advance(now)
+
+	def nextDeadline(self):
+		"""
+		Returns the earliest time a widget will change on its own or None.
+		"""
+		deadlines = [widget.nextDeadline() for z, order, widget in self.widgets]
+		deadlines = [deadline for deadline in deadlines if deadline is not None]
+		return min(deadlines) if deadlines else None
+
+	def render(self, now=None):
+		"""
+		Repaints the damaged areas and flushes the display. Does nothing if
+		nothing changed. Returns the number of pixels sent to the display.
+		"""
+		self.advance(now)
+		if not self.__damage:
+			return 0
+
+		# Damage caused while drawing is left for the next frame
+		damage = self.__damage
+		self.__damage = []
+
+		framebuffer = self.serdisp.framebuffer
+		try:
+			for rect in damage:
+				framebuffer.setClip(*rect)
+				framebuffer.fillRect(rect[0], rect[1], rect[2], rect[3], self.background)
+				for z, order, widget in self.widgets:
+					if _intersect(rect, widget.bounds()):
+						widget.repaint()
+		finally:
+			framebuffer.resetClip()
+
+		for z, order, widget in self.widgets:
+			self.__drawnBounds[widget] = widget.bounds()
+
+		return self.serdisp.flush()
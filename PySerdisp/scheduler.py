@@ -0,0 +1,139 @@
+# coding: utf-8
+
+import heapq
+import threading
+import time
+
+class FrameScheduler:
+	"""
+	Drives a Scene: renders a frame whenever something changed, but at most
+	`fps` times per second, and sleeps otherwise. It wakes up for widget
+	deadlines (ex. the next Text slice), timers added with every() and
+	invalidations coming from other threads. Changes arriving within one
+	frame interval are coalesced into one frame. If rendering takes longer
+	than a frame interval, the frames it overran are dropped instead of
+	being rendered back to back to catch up.
+
+		scheduler = FrameScheduler(scene, fps=10)
+		scheduler.every(1.0, lambda: clock.setText(time.strftime("%H:%M:%S")))
+		scheduler.run()
+
+	Widgets must only be changed from the scheduler thread (timers) or
+	while holding `scheduler.lock`.
+	"""
+	def __init__(self, scene, fps=30):
+		if fps <= 0:
+			raise ValueError("fps must be positive")
+
+		self.scene = scene
+		self.interval = 1.0 / fps
+		self.lock = threading.RLock()
+		self.running = False
+		self.framesRendered = 0
+		self.framesDropped = 0
+		self.__thread = None
+		self.__timers = []
+		self.__timerCount = 0
+		self.__wakeEvent = threading.Event()
+		self.__nextFrame = time.monotonic()
+		scene.onInvalidate = self.wake
+
+	def every(self, interval, callback):
+		"""
+		Calls `callback` every `interval` seconds from the scheduler thread,
+		ex. to refresh data shown by widgets. The first call happens right away.
+		"""
+		with self.lock:
+			self.__timerCount += 1
+			heapq.heappush(self.__timers, (time.time(), self.__timerCount, interval, callback))
+		self.wake()
+
+	def wake(self):
+		"""
+		Makes the scheduler look for work, safe to call from any thread.
+		"""
+		self.__wakeEvent.set()
+
+	def __runTimers(self, now):
+		while self.__timers and self.__timers[0][0] <= now:
+			due, count, interval, callback = heapq.heappop(self.__timers)
+			callback()
+			# Skip runs we missed instead of calling the callback repeatedly
+			due = max(due + interval, now)
+			heapq.heappush(self.__timers, (due, count, interval, callback))
+
+	def __nextDeadline(self):
+		deadlines = [self.scene.nextDeadline()]
+		if self.__timers:
+			deadlines.append(self.__timers[0][0])
+		deadlines = [deadline for deadline in deadlines if deadline is not None]
+		return min(deadlines) if deadlines else None
+
+	def __renderFrame(self):
+		start = time.monotonic()
+		if start < self.__nextFrame:
+			# Give more changes the chance to end up in this frame
+			time.sleep(self.__nextFrame - start)
+		else:
+			# Been idle or late, don't try to catch up
+			self.__nextFrame = start
+
+		with self.lock:
+			self.scene.render(time.time())
+		self.framesRendered += 1
+
+		overrun = int((time.monotonic() - self.__nextFrame) // self.interval)
+		if overrun > 0:
+			self.framesDropped += overrun
+		self.__nextFrame += self.interval * (max(0, overrun) + 1)
+
+	def step(self):
+		"""
+		Does one round of work: runs due timers, advances the widgets and
+		renders a frame if anything changed. Returns the number of seconds
+		until there is more work or None if there is nothing scheduled.
+		"""
+		self.__wakeEvent.clear()
+		now = time.time()
+		with self.lock:
+			self.__runTimers(now)
+			self.scene.advance(now)
+			dirty = self.scene.isDirty()
+
+		if dirty:
+			self.__renderFrame()
+			return 0
+
+		with self.lock:
+			deadline = self.__nextDeadline()
+		if deadline is None:
+			return None
+		return max(0, deadline - time.time())
+
+	def run(self):
+		"""
+		Runs until stop() is called.
+		"""
+		self.running = True
+		self.__loop()
+
+	def __loop(self):
+		while self.running:
+			timeout = self.step()
+			if timeout != 0 and self.running:
+				self.__wakeEvent.wait(timeout)
+
+	def start(self):
+		"""
+		Runs the scheduler in a background thread.
+		"""
+		self.running = True
+		self.__thread = threading.Thread(target=self.__loop, name="FrameScheduler", daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		self.running = False
+		self.wake()
+		if self.__thread is not None and self.__thread is not threading.current_thread():
+			self.__thread.join()
+			self.__thread = None
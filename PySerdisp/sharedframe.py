@@ -0,0 +1,185 @@
+# coding: utf-8
+
+"""
+A framebuffer in a memory mapped file other processes can draw into
+directly, ex. one in /dev/shm. Layout of the file, all values in native
+byte order:
+
+	offset 0	magic "SDFB"
+	offset 4	uint32 width
+	offset 8	uint32 height
+	offset 12	uint32 bytes per pixel (4, ARGB like framebuffer.Framebuffer)
+	offset 16	uint64 sequence counter
+	offset 64	the pixels row by row
+
+The sequence counter works like a seqlock: a producer makes it odd before
+it starts writing a frame and even again when the frame is complete. A new
+even value means a new frame is ready.
+"""
+
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+from framebuffer import Framebuffer, WHITE
+
+_HEADER = struct.Struct("=4sIII")
+_MAGIC = b"SDFB"
+_SEQUENCE = 16
+_PIXELS = 64
+_BYTES_PER_PIXEL = 4
+
+class SharedFramebuffer:
+	"""
+	Maps a shared framebuffer file. Use create() in the process owning the
+	display (or Serdisp.shareFramebuffer()) and open() in producers:
+
+		shared = SharedFramebuffer.open("/dev/shm/serdisp")
+		with shared.frame():
+			shared.framebuffer.fillRect(0, 0, 10, 10, framebuffer.BLACK)
+	"""
+	def __init__(self, path, mapped):
+		self.path = path
+		self.__mapped = mapped
+		magic, self.width, self.height, bytesPerPixel = _HEADER.unpack_from(mapped)
+		if magic != _MAGIC or bytesPerPixel != _BYTES_PER_PIXEL:
+			mapped.close()
+			raise ValueError("Not a shared framebuffer: %s" % path)
+
+		self.__memory = memoryview(mapped)
+		self.__sequence = self.__memory[_SEQUENCE:_SEQUENCE + 8].cast("Q")
+		self.framebuffer = Framebuffer(self.width, self.height, self.__memory[_PIXELS:])
+		# Sequence value of the last frame flushed to the display
+		self.flushedSequence = None
+		# Called with the SharedFramebuffer right before close() unmaps it
+		self.onClose = None
+		self.closed = False
+
+	@classmethod
+	def create(cls, path, width, height):
+		"""
+		Creates (or replaces) the file and fills the framebuffer with white.
+		"""
+		size = _PIXELS + width * height * _BYTES_PER_PIXEL
+		fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+		try:
+			os.ftruncate(fd, size)
+			mapped = mmap.mmap(fd, size)
+		finally:
+			os.close(fd)
+		_HEADER.pack_into(mapped, 0, _MAGIC, width, height, _BYTES_PER_PIXEL)
+
+		shared = cls(path, mapped)
+		shared.framebuffer.fill(WHITE)
+		return shared
+
+	@classmethod
+	def open(cls, path):
+		fd = os.open(path, os.O_RDWR)
+		try:
+			mapped = mmap.mmap(fd, 0)
+		finally:
+			os.close(fd)
+		return cls(path, mapped)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def sequence(self):
+		return self.__sequence[0]
+
+	def beginFrame(self):
+		self.__sequence[0] = self.__sequence[0] | 1
+
+	def endFrame(self):
+		self.__sequence[0] = (self.__sequence[0] | 1) + 1
+
+	@contextmanager
+	def frame(self):
+		"""
+		Marks everything drawn inside the with block as one frame.
+		"""
+		self.beginFrame()
+		try:
+			yield self.framebuffer
+		finally:
+			self.endFrame()
+
+	def ready(self):
+		"""
+		Returns True if a complete frame that hasn't been flushed yet is there.
+		"""
+		sequence = self.sequence()
+		return sequence & 1 == 0 and sequence != self.flushedSequence
+
+	def waitFrame(self, timeout=None, interval=0.005):
+		"""
+		Polls every `interval` seconds until ready(). Returns False on timeout.
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while not self.ready():
+			if deadline is not None and time.monotonic() >= deadline:
+				return False
+			time.sleep(interval)
+		return True
+
+	def flush(self, serdisp, full=False, attempts=3):
+		"""
+		Sends the pixels that differ from serdisp.shadow straight from the
+		shared memory to the display. Only complete frames are sent: while a
+		producer is inside a frame nothing is sent, and if one starts while
+		the changes are collected they are collected again, at most
+		`attempts` times. The shadow is updated with exactly the values sent
+		rather than copied from the framebuffer. Returns the number of pixels
+		sent, 0 if the frame was deferred.
+		"""
+		framebuffer = self.framebuffer
+		for attempt in range(attempts):
+			sequence = self.sequence()
+			if sequence & 1:
+				return 0
+			# The changes hold copies of the pixel values, they are a complete
+			# frame if no producer touched the counter meanwhile
+			if full:
+				changed = framebuffer.pixelList()
+			else:
+				changed = framebuffer.diff(serdisp.shadow)
+			if self.sequence() == sequence:
+				break
+		else:
+			return 0
+		self.flushedSequence = sequence
+
+		shadow = serdisp.shadow.pixels
+		width = self.width
+		setcolour = serdisp.fn.setcolour
+		disp = serdisp.disp
+		for x, y, argb in changed:
+			setcolour(disp, x, y, argb)
+			shadow[y * width + x] = argb
+
+		serdisp.update()
+		return len(changed)
+
+	def close(self):
+		"""
+		Unmaps the file. The framebuffer can't be used anymore afterwards,
+		a Serdisp sharing it goes back to a private one.
+		"""
+		if self.closed:
+			return
+		if self.onClose is not None:
+			self.onClose(self)
+		self.closed = True
+		self.framebuffer.pixels.release()
+		self.__sequence.release()
+		self.__memory.release()
+		self.__mapped.close()
+
+	def unlink(self):
+		os.unlink(self.path)
@@ -27,45 +27,133 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import os
+import threading
+import weakref
+
 import freetype
 
+from lrucache import CacheInfo, LRUCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Bitmap(object):
     """
     A 2D bitmap image represented as a list of byte values. Each byte indicates the state
     of a single pixel in the bitmap. A value of 0 indicates that the pixel is `off`
     and any other value indicates that it is `on`.
+
+    Rows are stored one after another, `stride` bytes apart, starting at `offset`
+    in `pixels`. Bitmaps returned by `crop` are views that share the pixels of the
+    bitmap they were cropped from instead of copying them.
     """
-    def __init__(self, width, height, pixels=None):
+    def __init__(self, width, height, pixels=None, stride=None, offset=0):
         self.width = width
         self.height = height
-        self.pixels = pixels or bytearray(int(width * height))
+        self.stride = width if stride is None else stride
+        self.offset = offset
+        self.pixels = pixels if pixels is not None else bytearray(int(width * height))
 
     def __repr__(self):
         """Return a string representation of the bitmap's pixels."""
         rows = ''
         for y in range(self.height):
-            for x in range(self.width):
-                rows += '#' if self.pixels[y * self.width + x] else '.'
+            for pixel in self.row(y):
+                rows += '#' if pixel else '.'
             rows += '\n'
         return rows
 
+    def _clip(self, x, y, width, height):
+        """Intersect the given rectangle with the bitmap, return (x0, y0, x1, y1) or None."""
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(self.width, x + width), min(self.height, y + height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
+
+    def row(self, y):
+        """Return a memoryview of the pixels in row `y`."""
+        start = self.offset + y * self.stride
+        return memoryview(self.pixels)[start:start + self.width]
+
+    def buffer(self):
+        """Return a memoryview of the pixels starting at the first pixel of this bitmap."""
+        return memoryview(self.pixels)[self.offset:]
+
+    def array(self):
+        """Return a 2D NumPy view (rows, columns) of the pixels. Needs NumPy."""
+        flat = numpy.frombuffer(self.pixels, dtype=numpy.uint8)[self.offset:]
+        return numpy.lib.stride_tricks.as_strided(flat,
+            shape=(self.height, self.width), strides=(self.stride, 1))
+
+    def tobytes(self):
+        """Return the pixels as bytes without any padding between rows."""
+        if self.stride == self.width:
+            return bytes(self.buffer()[:self.width * self.height])
+        return b''.join(self.row(y) for y in range(self.height))
+
+    def crop(self, x, y, width, height):
+        """
+        Return a view of the given rectangle, clipped to this bitmap. Changes
+        to either bitmap show up in the other one.
+        """
+        clipped = self._clip(x, y, width, height)
+        if not clipped:
+            return Bitmap(0, 0, bytearray())
+
+        x0, y0, x1, y1 = clipped
+        return Bitmap(x1 - x0, y1 - y0, self.pixels, self.stride,
+                      self.offset + y0 * self.stride + x0)
+
+    def copy(self):
+        """Return a compact copy of this bitmap that doesn't share its pixels."""
+        return Bitmap(self.width, self.height, bytearray(self.tobytes()))
+
+    def fill(self, value, x=0, y=0, width=None, height=None):
+        """Set all pixels within the given rectangle (default: everything) to `value`."""
+        width = self.width if width is None else width
+        height = self.height if height is None else height
+        clipped = self._clip(x, y, width, height)
+        if not clipped:
+            return
+
+        x0, y0, x1, y1 = clipped
+        span = bytes([value]) * (x1 - x0)
+        for dy in range(y0, y1):
+            start = self.offset + dy * self.stride + x0
+            self.pixels[start:start + len(span)] = span
+
     def bitblt(self, src, x, y):
-        """Copy all pixels from `src` into this bitmap"""
-        srcpixel = 0
-        dstpixel = int(y * self.width + x)
-        row_offset = int(self.width - src.width)
-
-        for sy in range(src.height):
-            for sx in range(src.width):
-                # Perform an OR operation on the destination pixel and the source pixel
-                # because glyph bitmaps may overlap if character kerning is applied, e.g.
-                # in the string "AVA", the "A" and "V" glyphs must be rendered with
-                # overlapping bounding boxes.
-                self.pixels[dstpixel] = self.pixels[dstpixel] or src.pixels[srcpixel]
-                srcpixel += 1
-                dstpixel += 1
-            dstpixel += row_offset
+        """
+        Copy all pixels from `src` into this bitmap at (x, y), clipped to this bitmap.
+
+        Pixels are combined with an OR operation because glyph bitmaps may overlap
+        if character kerning is applied, e.g. in the string "AVA", the "A" and "V"
+        glyphs must be rendered with overlapping bounding boxes.
+        """
+        clipped = self._clip(x, y, src.width, src.height)
+        if not clipped:
+            return
+
+        x0, y0, x1, y1 = clipped
+        if numpy is not None:
+            self.array()[y0:y1, x0:x1] |= src.array()[y0 - y:y1 - y, x0 - x:x1 - x]
+            return
+
+        # Without NumPy, whole rows are OR'ed as big integers. This works since
+        # OR never carries from one byte into the next.
+        span = x1 - x0
+        src_pixels = memoryview(src.pixels)
+        for dy in range(y0, y1):
+            src_start = src.offset + (dy - y) * src.stride + (x0 - x)
+            dst_start = self.offset + dy * self.stride + x0
+            combined = (int.from_bytes(self.pixels[dst_start:dst_start + span], 'big') |
+                        int.from_bytes(src_pixels[src_start:src_start + span], 'big'))
+            self.pixels[dst_start:dst_start + span] = combined.to_bytes(span, 'big')
 
 
 class Glyph(object):
@@ -112,6 +200,9 @@ class Glyph(object):
         Unpack a freetype FT_LOAD_TARGET_MONO glyph bitmap into a bytearray where each
         pixel is represented by a single byte.
         """
+        if numpy is not None:
+            return Glyph._unpack_mono_bitmap_numpy(bitmap)
+
         # Allocate a bytearray of sufficient size to hold the glyph bitmap.
         data = bytearray(bitmap.rows * bitmap.width)
 
@@ -147,13 +238,42 @@ class Glyph(object):
 
         return data
 
+    @staticmethod
+    def _unpack_mono_bitmap_numpy(bitmap):
+        """Same as `unpack_mono_bitmap`, but unpacks all rows in one go using NumPy."""
+        if bitmap.rows == 0 or bitmap.width == 0:
+            return bytearray()
+
+        # Each row is `pitch` bytes long and padded to a byte boundary, so
+        # unpacking yields pitch * 8 pixels per row of which we keep `width`.
+        packed = numpy.array(bitmap.buffer[:bitmap.rows * bitmap.pitch], dtype=numpy.uint8)
+        bits = numpy.unpackbits(packed.reshape(bitmap.rows, bitmap.pitch), axis=1)
+        return bytearray(bits[:, :bitmap.width].tobytes())
+
 
 class Font(object):
-    def __init__(self, filename, size):
+    def __init__(self, filename, size, cache_size=256):
         self.face = freetype.Face(filename)
         self.face.set_pixel_sizes(0, size)
 
+        # Rendered glyphs are cached per character and kerning offsets per
+        # character pair. Cached glyph bitmaps are shared, don't modify them.
+        self.glyph_cache = LRUCache(cache_size)
+        self.kerning_cache = LRUCache(cache_size)
+
+        # Fonts from get_font() may be used by several threads, but neither
+        # FreeType faces nor the caches may be used concurrently.
+        self._lock = threading.Lock()
+
+    def cache_info(self):
+        """Return (glyph cache info, kerning cache info) as CacheInfo tuples."""
+        return (self.glyph_cache.info(), self.kerning_cache.info())
+
     def glyph_for_character(self, char):
+        with self._lock:
+            return self.glyph_cache.get(char, self._load_glyph)
+
+    def _load_glyph(self, char):
         # Let FreeType load the glyph for the given character and tell it to render
         # a monochromatic bitmap representation.
         self.face.load_char(char, freetype.FT_LOAD_RENDER | freetype.FT_LOAD_TARGET_MONO)
@@ -174,7 +294,11 @@ class Font(object):
         case the glyph for "V" has a negative horizontal kerning offset as it is
         moved slightly towards the "A".
         """
-        kerning = self.face.get_kerning(previous_char, char)
+        with self._lock:
+            return self.kerning_cache.get((previous_char, char), self._load_kerning)
+
+    def _load_kerning(self, pair):
+        kerning = self.face.get_kerning(*pair)
 
         # The kerning offset is given in FreeType's 26.6 fixed point format,
         # which means that the pixel values are multiples of 64.
@@ -246,6 +370,25 @@ class Font(object):
 
         return outbuffer
 
+# Fonts handed out by get_font(). Entries go away as soon as nobody uses the font anymore.
+_font_pool = weakref.WeakValueDictionary()
+_font_pool_lock = threading.Lock()
+
+
+def get_font(filename, size):
+    """
+    Return a Font for `filename` at `size` pixels that is shared with every other
+    caller asking for the same font, so the font file is only parsed once.
+    """
+    key = (os.path.realpath(filename), size)
+    with _font_pool_lock:
+        font = _font_pool.get(key)
+        if font is None:
+            font = Font(filename, size)
+            _font_pool[key] = font
+        return font
+
+
 if __name__ == '__main__':
     # Be sure to place 'helvetica.ttf' (or any other ttf / otf font file) in the working directory.
     fnt = Font('helvetica.ttf', 24)
@@ -0,0 +1,288 @@
+# coding: utf-8
+
+import time
+from array import array
+from collections import Counter
+from functools import wraps
+
+def _entry(func):
+	"""
+	Marks a serdisplib entry point: counts the call and simulates the
+	configured per-call latency.
+	"""
+	name = func.__name__
+
+	@wraps(func)
+	def call(self, *args):
+		self.calls[name] += 1
+		if self.callLatency:
+			time.sleep(self.callLatency)
+		return func(self, *args)
+	return call
+
+class VirtualDisplay:
+	"""
+	In-process stand-in for libserdisp.so. Provides the serdisplib entry
+	points Serdisp uses and keeps the display contents in memory, so
+	everything above the ctypes layer can run without hardware:
+
+		with Serdisp("VIRTUAL", "VIRTUAL", backend=VirtualDisplay(240, 128)) as serdisp:
+			...
+
+	Depths up to 8 behave like a greyscale panel where the hardware value
+	counts the darkness of a pixel, 16 and 24 like RGB565 and RGB888 panels.
+	`calls` counts the calls per entry point. `callLatency` and
+	`updateLatency` (seconds) are added to every call or every
+	update/rewrite respectively to mimic slow devices.
+	"""
+
+	# Options the virtual display pretends to support: name, aliases, min, max, modulo, flag, defines
+	OPTIONS = (
+		(b"INVERT", b"INV", 0, 1, 1, 0, b"NO=0,YES=1"),
+		(b"BACKLIGHT", b"BGLIGHT", 0, 1, 1, 0, b"OFF=0,ON=1"),
+		(b"CONTRAST", b"", 0, 10, 1, 0, b""),
+	)
+
+	def __init__(self, width=128, height=64, depth=1, callLatency=0.0, updateLatency=0.0):
+		if depth not in (1, 2, 4, 8, 16, 24):
+			raise ValueError("Unsupported depth: %i" % depth)
+
+		self.width = width
+		self.height = height
+		self.depth = depth
+		self.callLatency = callLatency
+		self.updateLatency = updateLatency
+		self.calls = Counter()
+		self.updates = 0
+		self.debugLevel = 0
+		self.options = dict((opt[0], opt[2]) for opt in self.OPTIONS)
+
+		# Hardware colour values: `buffer` is what has been drawn, `screen`
+		# what the last update() made visible.
+		self.buffer = array("I", [0]) * (width * height)
+		self.screen = array("I", self.buffer)
+
+	def resetCounters(self):
+		self.calls.clear()
+		self.updates = 0
+
+	def __isGrey(self):
+		return self.depth <= 8
+
+	def __maxGrey(self):
+		return (1 << self.depth) - 1
+
+	def __inside(self, x, y):
+		return 0 <= x < self.width and 0 <= y < self.height
+
+	# Colour conversion, see serdisp_colour.h
+
+	def __trans(self, argb):
+		r = (argb >> 16) & 0xFF
+		g = (argb >> 8) & 0xFF
+		b = argb & 0xFF
+
+		if self.__isGrey():
+			luminance = (r * 299 + g * 587 + b * 114) // 1000
+			return (255 - luminance) >> (8 - self.depth)
+		elif self.depth == 16:
+			return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+		else:
+			return (r << 16) | (g << 8) | b
+
+	def __lookup(self, sdcol):
+		if self.__isGrey():
+			grey = 255 - (sdcol * 255) // self.__maxGrey()
+			return 0xFF000000 | (grey << 16) | (grey << 8) | grey
+		elif self.depth == 16:
+			r = ((sdcol >> 11) & 0x1F) * 255 // 0x1F
+			g = ((sdcol >> 5) & 0x3F) * 255 // 0x3F
+			b = (sdcol & 0x1F) * 255 // 0x1F
+			return 0xFF000000 | (r << 16) | (g << 8) | b
+		else:
+			return 0xFF000000 | sdcol
+
+	# serdisp_connect.h
+
+	@_entry
+	def SDCONN_open(self, device):
+		return 1
+
+	# serdisp_control.h
+
+	@_entry
+	def serdisp_init(self, conn, model, options):
+		return 1 if conn else None
+
+	@_entry
+	def serdisp_close(self, dd):
+		pass
+
+	@_entry
+	def serdisp_quit(self, dd):
+		pass
+
+	@_entry
+	def serdisp_reset(self, dd):
+		return 1
+
+	@_entry
+	def serdisp_fullreset(self, dd):
+		return dd
+
+	@_entry
+	def serdisp_isdisplay(self, dd, *args):
+		return 1
+
+	@_entry
+	def serdisp_setpixel(self, dd, x, y, sdcol):
+		if self.__inside(x, y):
+			self.buffer[y * self.width + x] = sdcol
+
+	@_entry
+	def serdisp_getpixel(self, dd, x, y):
+		if not self.__inside(x, y):
+			return 0
+		return self.buffer[y * self.width + x]
+
+	@_entry
+	def serdisp_clear(self, dd):
+		self.buffer[:] = array("I", [self.__trans(0xFFFFFFFF)]) * len(self.buffer)
+		self.__refresh()
+
+	@_entry
+	def serdisp_clearbuffer(self, dd):
+		self.buffer[:] = array("I", [self.__trans(0xFFFFFFFF)]) * len(self.buffer)
+
+	@_entry
+	def serdisp_update(self, dd):
+		self.__refresh()
+
+	@_entry
+	def serdisp_rewrite(self, dd):
+		self.__refresh()
+
+	def __refresh(self):
+		self.screen[:] = self.buffer
+		self.updates += 1
+		if self.updateLatency:
+			time.sleep(self.updateLatency)
+
+	@_entry
+	def serdisp_blink(self, dd, what, count, delta):
+		pass
+
+	@_entry
+	def serdisp_getwidth(self, dd):
+		return self.width
+
+	@_entry
+	def serdisp_getheight(self, dd):
+		return self.height
+
+	@_entry
+	def serdisp_getcolours(self, dd):
+		return 1 << self.depth
+
+	@_entry
+	def serdisp_getdepth(self, dd):
+		return self.depth
+
+	@_entry
+	def serdisp_getpixelaspect(self, dd):
+		return 100
+
+	@_entry
+	def serdisp_getoption(self, dd, name, typesize):
+		return self.options.get(name, -1)
+
+	@_entry
+	def serdisp_setoption(self, dd, name, value):
+		if name in self.options:
+			self.options[name] = value
+
+	@_entry
+	def serdisp_isoption(self, dd, name):
+		return 1 if name in self.options else 0
+
+	@_entry
+	def serdisp_nextoptiondescription(self, dd, descPointer):
+		desc = descPointer.contents
+		names = [opt[0] for opt in self.OPTIONS]
+
+		# An empty name asks for the first option
+		if not desc.name:
+			index = 0
+		elif desc.name in names:
+			index = names.index(desc.name) + 1
+		else:
+			return 0
+
+		if index >= len(self.OPTIONS):
+			return 0
+
+		(desc.name, desc.aliasnames, desc.minval, desc.maxval,
+			desc.modulo, desc.flag, desc.defines) = self.OPTIONS[index]
+		return 1
+
+	# serdisp_colour.h
+
+	@_entry
+	def serdisp_getcolour(self, dd, x, y):
+		if not self.__inside(x, y):
+			return 0
+		return self.__lookup(self.buffer[y * self.width + x])
+
+	@_entry
+	def serdisp_setcolour(self, dd, x, y, argb):
+		if self.__inside(x, y):
+			self.buffer[y * self.width + x] = self.__trans(argb)
+
+	@_entry
+	def serdisp_getgrey(self, dd, x, y):
+		if not self.__inside(x, y):
+			return 0
+		return self.__lookup(self.buffer[y * self.width + x]) & 0xFF
+
+	@_entry
+	def serdisp_setgrey(self, dd, x, y, grey):
+		if self.__inside(x, y):
+			self.buffer[y * self.width + x] = self.__trans(0xFF000000 | (grey << 16) | (grey << 8) | grey)
+
+	@_entry
+	def serdisp_transcolour(self, dd, argb):
+		return self.__trans(argb)
+
+	@_entry
+	def serdisp_transgrey(self, dd, grey):
+		return self.__trans(0xFF000000 | (grey << 16) | (grey << 8) | grey)
+
+	@_entry
+	def serdisp_lookupcolour(self, dd, sdcol):
+		return self.__lookup(sdcol)
+
+	@_entry
+	def serdisp_lookupgrey(self, dd, sdcol):
+		return self.__lookup(sdcol) & 0xFF
+
+	# serdisp_messages.h
+
+	@_entry
+	def sd_runtime_error(self):
+		return 0
+
+	@_entry
+	def sd_geterrormsg(self):
+		return b""
+
+	@_entry
+	def sd_getdebuglevel(self):
+		return self.debugLevel
+
+	@_entry
+	def sd_setdebuglevel(self, level):
+		self.debugLevel = level
+
+	@_entry
+	def sd_setlogmedium(self, medium):
+		pass
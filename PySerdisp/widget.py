@@ -1,16 +1,66 @@
 # coding=utf-8
 
 from math import ceil
-from pyserdisp import Serdisp
-from textrenderer import Font
+from framebuffer import packColour, rgbToArgb, WHITE
+from textrenderer import Bitmap, get_font
+import imagecache
+import primitives
+from dither import dither, MODES as DITHER_MODES
 import time
 from PIL import Image
 import os
 import sys
 
-class Pixmap:
-	def __init__(self, serdisp, path, position):
-		if not isinstance(serdisp, Serdisp):
+class Widget:
+	"""
+	Common base of all widgets. Widgets tell the Scene they have been added to
+	when their content changes by calling invalidate().
+	"""
+	scene = None
+
+	def bounds(self):
+		"""
+		Returns the area (x, y, width, height) the widget draws into.
+		"""
+		return (self.position[0], self.position[1], self.size[0], self.size[1])
+
+	def invalidate(self, rect=None):
+		"""
+		Tells the scene the widget needs repainting, only within `rect`
+		(x, y, width, height) if given.
+		"""
+		if self.scene is not None:
+			self.scene.invalidate(self, rect)
+
+	def repaint(self):
+		"""
+		Draws the whole widget. draw() may skip what is unchanged since the
+		last call, a Scene clears the damaged area first and calls this.
+		"""
+		self.draw()
+
+	def advance(self, now):
+		"""
+		Updates time-based state. Widgets that change over time invalidate
+		themselves here.
+		"""
+		pass
+
+	def nextDeadline(self):
+		"""
+		Returns the time (as in time.time()) the widget will change next on
+		its own or None if it only changes when told to.
+		"""
+		return None
+
+class Pixmap(Widget):
+	# Directory for converted images, caching is off if None. Can be set
+	# here for all pixmaps or per pixmap with the cacheDir argument.
+	cacheDir = None
+
+	def __init__(self, serdisp, path, position, cacheDir=None, dither="threshold"):
+		# Anything with a framebuffer and the Serdisp getters will do, ex. a DisplayClient
+		if not hasattr(serdisp, "framebuffer"):
 			raise ValueError("serdisp must be a Serdisp instance!")
 
 		self.serdisp = serdisp
@@ -18,6 +68,31 @@ class Pixmap:
 		self.position = position
 		if position[0] < 0 or position[1] < 0:
 			print("Warning: position of", path, "is < 0:", position)
+		self.depth = serdisp.getDepth()
+		if dither not in DITHER_MODES:
+			raise ValueError("Unknown dither mode: %s" % dither)
+		# Colour displays show the image as it is
+		self.dither = dither if self.depth <= 8 else "none"
+		if cacheDir is not None:
+			self.cacheDir = cacheDir
+
+		cacheKey = None
+		try:
+			cacheKey = imagecache.cacheKey(path, self.depth, self.dither)
+		except OSError:
+			pass # Image doesn't exist, Image.open below complains about it
+
+		# Pixmaps of the same image share their pixels, within the process
+		# or through the cache directory
+		if cacheKey is not None:
+			cached = imagecache.getShared(cacheKey)
+			if cached is None and self.cacheDir is not None:
+				cached = imagecache.load(self.cacheDir, cacheKey)
+				if cached is not None:
+					imagecache.putShared(cacheKey, *cached)
+			if cached is not None:
+				self.size, bytesPerPixel, self.data = cached
+				return
 
 		# load the image
 		img = None
@@ -29,31 +104,46 @@ class Pixmap:
 			print(e)
 			return
 
-		# TODO only if necessary
-		img.convert("1") # Convert to black/white mode
-		imgData = list(img.getdata())
 		self.size = img.size
-		self.data = [imgData[i * self.size[0]:(i + 1) * self.size[0]] for i in range(self.size[1])]
+		self.data = self.__convert(img)
+
+		if cacheKey is not None:
+			bytesPerPixel = 4 if self.depth > 8 else 1
+			imagecache.putShared(cacheKey, self.size, bytesPerPixel, self.data)
+			if self.cacheDir is not None:
+				imagecache.store(self.cacheDir, cacheKey, self.size, bytesPerPixel, self.data)
+
+	def __convert(self, img):
+		"""
+		Converts the image to what the display can show: one grey level byte per
+		pixel for greyscale displays (depth <= 8), dithered down to the levels
+		the display has, ARGB values for colour displays.
+		"""
+		if self.depth > 8:
+			return rgbToArgb(img.convert("RGB").tobytes())
+
+		return dither(img.convert("L").tobytes(), img.size[0], img.size[1], self.depth, self.dither)
 
 	def draw(self):
 		"""
 		Draws the pixmap at the given location.
 		"""
-		for x in range(self.size[0]):
-			for y in range(self.size[1]):
-				# HACK: Just taking the red value here since we
-				# hardcoded conversion to greyscale above.
-				self.serdisp.setGrey((x, y), self.data[y][x][0])
+		framebuffer = self.serdisp.framebuffer
+		if self.depth > 8:
+			framebuffer.blitArgb(self.position[0], self.position[1], self.size[0], self.size[1], self.data)
+		else:
+			framebuffer.blitGrey(self.position[0], self.position[1], self.size[0], self.size[1], self.data)
 
 	def erase(self):
 		"""
 		Sets every pixel of the affected region to white.
 		"""
-		for x in range(self.size[0]):
-			for y in range(self.size[1]):
-				self.serdisp.setGrey((x, y), (255, 255, 255, 255))
+		self.serdisp.framebuffer.fillRect(self.position[0], self.position[1], self.size[0], self.size[1], WHITE)
 
-class Text:
+# Maps "on" bitmap pixels to black and "off" ones to white
+_MONO_TO_GREY = bytes([255] + [0] * 255)
+
+class Text(Widget):
 	def __init__(self, serdisp, position, fontpath, fontsize, text, **kwargs):
 		self.serdisp = serdisp
 		# Store user defined pos/offsets separately, we must not overwrite those in setText!
@@ -65,11 +155,19 @@ class Text:
 			raise ValueError("Font doesn't exist:", fontpath)
 
 		self.kwargs = kwargs
-		self.font = Font(fontpath, fontsize)
-		self.setText(text)
+		self.font = get_font(fontpath, fontsize)
 		self.lastSlice = 0
 		self.lastDrawTime = None
 
+		# Marquee mode scrolls long texts smoothly instead of showing slices
+		self.marquee = bool(self.kwargs.get("marquee", False))
+		self.speed = float(self.kwargs.get("speed", 30.0))
+		self.step = max(1, int(self.kwargs.get("step", 1)))
+		self.gap = int(self.kwargs.get("gap", 2 * fontsize))
+		self.scrollStart = None
+		self.scrollOffset = 0
+		self.setText(text)
+
 		if "sliceDuration" in list(self.kwargs.keys()):
 		    self.sliceDuration = float(self.kwargs["sliceDuration"])
 		else:
@@ -86,6 +184,9 @@ class Text:
 
 		self.text = text
 		self.bitmap = self.font.render_text(self.text)
+		# Converted once here so draw() only needs to cut out the visible slice
+		self.greyBitmap = Bitmap(self.bitmap.width, self.bitmap.height,
+			self.bitmap.tobytes().translate(_MONO_TO_GREY))
 		self.size = [
 			int(round(min(self.bitmap.width, self.serdisp.getWidth() - 2))),
 			int(round(min(self.bitmap.height, self.serdisp.getHeight() - 2)))
@@ -97,6 +198,8 @@ class Text:
 		    self.sliceCount = int(ceil(self.bitmap.width / float(self.size[0])))
 		else:
 		    self.sliceCount = 1
+		self.lastSlice = min(self.lastSlice, self.sliceCount - 1)
+		self.__buildStrip()
 
 		# Setup of the actual rendering position (might be different from self.userPos!)
 		if "halign" in list(self.kwargs.keys()):
@@ -110,18 +213,75 @@ class Text:
 			elif self.kwargs["valign"] == "bottom":
 				self.position[1] = self.serdisp.getHeight() - self.bitmap.height - self.userPos[1]
 
-	def __getCurrentSliceIdx(self):
+		self.invalidate()
+
+	def __buildStrip(self):
+		"""
+		Lays out the text, a gap and the beginning of the text again in one
+		bitmap for marquee mode. Any window of the visible width starting
+		within the first text + gap pixels is then a single blit.
+		"""
+		self.strip = None
+		if not self.marquee or self.bitmap.width <= self.size[0]:
+			return
+
+		width = self.greyBitmap.width
+		grey = self.greyBitmap.tobytes()
+		gap = _MONO_TO_GREY[:1] * self.gap
+		rows = []
+		for y in range(self.greyBitmap.height):
+			row = grey[y * width:(y + 1) * width]
+			rows.append(row + gap + row[:self.size[0]])
+		self.strip = Bitmap(width + self.gap + self.size[0], self.greyBitmap.height, b"".join(rows))
+		self.stripPeriod = width + self.gap
+		self.scrollOffset %= self.stripPeriod
+
+	def __scrollSteps(self, now):
+		return int((now - self.scrollStart) * self.speed / self.step)
+
+	def advance(self, now=None):
+		"""
+		Moves on to the next slice once the current one has been shown for sliceDuration.
+		In marquee mode, moves the text on by `step` pixels at `speed` pixels per second.
+		"""
+		if now is None:
+			now = time.time()
+
+		if self.strip is not None:
+			if self.scrollStart is None:
+				self.scrollStart = now
+			offset = (self.__scrollSteps(now) * self.step) % self.stripPeriod
+			if offset != self.scrollOffset:
+				self.scrollOffset = offset
+				self.invalidate()
+			return
+
 		slcIdx = self.lastSlice
 
 		if not self.lastDrawTime:
-			self.lastDrawTime = time.time()
+			self.lastDrawTime = now
 			slcIdx = 0
-		elif (time.time() - self.lastDrawTime) > self.sliceDuration:
-			self.lastDrawTime = time.time()
+		elif (now - self.lastDrawTime) >= self.sliceDuration:
+			self.lastDrawTime = now
 			slcIdx = (slcIdx + 1) % self.sliceCount
 
 		assert(slcIdx < self.sliceCount)
-		return slcIdx
+		if slcIdx != self.lastSlice:
+			self.lastSlice = slcIdx
+			self.invalidate()
+
+	def nextDeadline(self):
+		if self.strip is not None:
+			if self.scrollStart is None:
+				return 0
+			if self.speed <= 0:
+				return None
+			return self.scrollStart + (self.__scrollSteps(time.time()) + 1) * self.step / self.speed
+		if self.sliceCount <= 1:
+			return None
+		if not self.lastDrawTime:
+			return 0
+		return self.lastDrawTime + self.sliceDuration
 
 	def __getSlice(self, slcIdx):
 		slcWidth = self.size[0]
@@ -139,21 +299,24 @@ class Text:
 				round(slcCenter + slcWidth / 2)]
 
 	def draw(self):
-		slcIdx = self.__getCurrentSliceIdx()
-		self.lastSlice = slcIdx
+		self.advance()
+		if self.strip is not None:
+			window = self.strip.crop(self.scrollOffset, 0, self.size[0], self.size[1])
+			self.serdisp.framebuffer.blitGrey(self.position[0], self.position[1],
+				window.width, window.height, window.buffer(), window.stride)
+			return
+
 		#print("Drawing: \"%s\" (%i, %i of %i)" % (self.text, self.lastSlice + 1, self.sliceCount))
-		slc = self.__getSlice(slcIdx)
-		intWidth = round(self.bitmap.width)
+		slc = self.__getSlice(self.lastSlice)
 
-		for y in range(self.size[1]):
-			for x in range(slc[1] - slc[0]):
-				pixpos = [self.position[0] + x, self.position[1] + y]
-				pixel = (1 - self.bitmap.pixels[slc[0] + x + y * intWidth]) * 255
-				self.serdisp.setGrey(pixpos, pixel)
+		# A view into the rendered text, nothing gets copied until the framebuffer blit
+		window = self.greyBitmap.crop(slc[0], 0, slc[1] - slc[0], self.size[1])
+		self.serdisp.framebuffer.blitGrey(self.position[0], self.position[1],
+			window.width, window.height, window.buffer(), window.stride)
 
-class Progressbar:
+class Progressbar(Widget):
 	def __init__(self, serdisp, position, size, **kwargs):
-		if not isinstance(serdisp, Serdisp):
+		if not hasattr(serdisp, "framebuffer"):
 			raise ValueError("serdisp must be an instance of Serdisp.")
 
 		self.serdisp = serdisp
@@ -166,6 +329,11 @@ class Progressbar:
 			raise ValueError("size must be greater than 1")
 		self.size = size
 
+		# Fill width of what is on the framebuffer, None until drawn, and
+		# the framebuffer and its generation it was drawn on
+		self.__drawnWidth = None
+		self.__drawnOn = None
+
 		# Ugly! But that is the pythonic way, isn't it?
 		try:
 			self.setState(kwargs["state"])
@@ -182,21 +350,74 @@ class Progressbar:
 			self.colour = kwargs["colour"]
 		except:
 			self.colour = (255, 0, 0, 0)
+		self.argb = packColour(self.colour)
+		self.background = packColour(kwargs.get("background", WHITE))
 
 	def setState(self, state):
 		self.state = min(1, max(0, state))
+		if not self.__drawn():
+			self.invalidate()
+			return
+
+		# Only the columns between the old and the new fill level change
+		fillWidth = self.__fillWidth()
+		if fillWidth != self.__drawnWidth:
+			x, y, width, height = self.__content()
+			left = min(fillWidth, self.__drawnWidth)
+			self.invalidate((x + left, y, abs(fillWidth - self.__drawnWidth), height))
+
+	def __content(self):
+		"""
+		Returns the area (x, y, width, height) inside the border.
+		"""
+		if self.drawBorder:
+			return (self.position[0] + 1, self.position[1] + 1, self.size[0] - 2, self.size[1] - 2)
+		return (self.position[0], self.position[1], self.size[0], self.size[1])
+
+	def __fillWidth(self):
+		return int(round(self.state * float(self.__content()[2])))
+
+	def __drawn(self):
+		"""
+		Returns True if the bar drawn last is still on the framebuffer, it is
+		gone once the framebuffer has been filled (ex. by Serdisp.clear()) or
+		replaced.
+		"""
+		framebuffer = self.serdisp.framebuffer
+		return self.__drawnOn == (framebuffer, framebuffer.generation)
 
 	def draw(self):
+		"""
+		Repaints what changed since the last draw() or repaint(), or the
+		whole bar if the framebuffer has been cleared since.
+		"""
+		if not self.__drawn():
+			self.repaint()
+			return
+
+		fillWidth = self.__fillWidth()
+		if fillWidth == self.__drawnWidth:
+			return
+
+		framebuffer = self.serdisp.framebuffer
+		x, y, width, height = self.__content()
+		if fillWidth > self.__drawnWidth:
+			primitives.fillRect(framebuffer, x + self.__drawnWidth, y, fillWidth - self.__drawnWidth, height, self.argb)
+		else:
+			primitives.clearRegion(framebuffer, x + fillWidth, y, self.__drawnWidth - fillWidth, height, self.background)
+		self.__drawnWidth = fillWidth
+
+	def repaint(self):
+		"""
+		Draws the whole bar regardless of what has been drawn before.
+		"""
+		framebuffer = self.serdisp.framebuffer
 		if self.drawBorder:
-			for x in range(self.size[0]):
-				self.serdisp.setColour((self.position[0] + x, self.position[1]), self.colour)
-				self.serdisp.setColour((self.position[0] + x, self.position[1] + selfsize[1] - 1), self.colour)
-			for y in range(self.size[1] - 1):
-				self.serdisp.setColour((self.position[0], self.position[1] + y), self.colour)
-				self.serdisp.setColour((self.position[0] + self.size[0] - 1, self.position[1] + y), self.colour)
-
-		# draw the status bar "content"
-		contentWidth = int(round(self.state * float(self.size[0])))
-		for x in range(contentWidth):
-			for y in range(self.size[1] - 1):
-				self.serdisp.setColour((self.position[0] + x, self.position[1] + y), self.colour)
+			primitives.rect(framebuffer, self.position[0], self.position[1], self.size[0], self.size[1], self.argb)
+
+		x, y, width, height = self.__content()
+		fillWidth = self.__fillWidth()
+		primitives.fillRect(framebuffer, x, y, fillWidth, height, self.argb)
+		primitives.clearRegion(framebuffer, x + fillWidth, y, width - fillWidth, height, self.background)
+		self.__drawnWidth = fillWidth
+		self.__drawnOn = (framebuffer, framebuffer.generation)